@@ -0,0 +1,229 @@
+"""
+Teste de carga das páginas Streamlit: várias sessões simultâneas (tesouraria
+e secretaria) percorrendo as páginas reais do demo.py pela API de testes do
+Streamlit (streamlit.testing.v1.AppTest), com uma mistura configurável de
+leituras e escritas.
+
+Cada sessão é um AppTest próprio num processo próprio: o AppTest troca
+estado global do Streamlit (Runtime, st.secrets) a cada execução e não pode
+rodar em várias threads ao mesmo tempo. Por isso cada sessão tem o seu pool e
+o seu cache (cenário mais pessimista que o servidor real, onde o cache é
+compartilhado). As sessões só começam juntas, depois de todas importarem o
+app, e mede-se cada rerun do script. O pico de memória é a soma dos picos
+(tracemalloc) das sessões: o que N sessões acrescentam ao processo.
+
+O banco deve ser um substituto local (SQL Server em contêiner/Express com uma
+cópia do banco), nunca o de produção: as escritas gravam lançamentos do ano
+corrente. A conexão vem do mesmo TOML da aplicação (--config).
+
+Exemplo:
+    python carga.py --config carga.toml --sessoes 1,5,10,20 --acoes 30 --escrita 0.2
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import pathlib
+import random
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+import dados
+from demo import credenciais_igreja
+
+APP = str(pathlib.Path(__file__).with_name("demo.py"))
+TIMEOUT_RERUN = 60     # segundos
+TIMEOUT_BARREIRA = 300  # segundos esperando as demais sessões importarem o app
+
+# perfil -> (usuário, páginas que a sessão visita)
+PERFIS = {
+    "tesouraria": ("adm-financeiro", ["Cadastro de Membros", "Relatórios", "Página Financeira"]),
+    "secretaria": ("adm-secretaria", ["Cadastro de Igreja", "Cadastro de Membros"]),
+}
+
+
+def _widget(colecao, label):
+    for w in colecao:
+        if w.label == label:
+            return w
+    raise LookupError(f"widget '{label}' não encontrado")
+
+
+class SessaoSimulada:
+    """Uma sessão de navegador: login e ações sobre um AppTest, medindo cada rerun."""
+
+    def __init__(self, perfil, secrets, tenant, rng):
+        self.usuario, self.paginas = PERFIS[perfil]
+        self.perfil = perfil
+        self.tenant = tenant
+        self.rng = rng
+        self.latencias = []
+        self.erros = 0
+        self.ultimo_erro = None
+        self.at = AppTest.from_file(APP, default_timeout=TIMEOUT_RERUN)
+        self.at.secrets.update(secrets)
+
+    def _rerun(self, acao):
+        inicio = time.perf_counter()
+        acao()
+        self.latencias.append(time.perf_counter() - inicio)
+        if self.at.exception:
+            self.erros += 1
+            self.ultimo_erro = self.at.exception[0].message
+
+    def login(self):
+        self._rerun(self.at.run)
+        if len(dados.tenants()) > 1:
+            _widget(self.at.selectbox, "Igreja").select(self.tenant)
+        senha = credenciais_igreja(self.tenant, dados.tenants())[self.usuario]
+        _widget(self.at.text_input, "Usuário").input(self.usuario)
+        _widget(self.at.text_input, "Senha").input(senha)
+        self._rerun(_widget(self.at.button, "Entrar").click().run)
+        self._rerun(self.at.run)  # rerun pedido pelo st.rerun() do login
+
+    def navegar(self, pagina):
+        self._rerun(_widget(self.at.sidebar.selectbox, "Selecione a Página").select(pagina).run)
+
+    def ler(self):
+        pagina = self.rng.choice(self.paginas)
+        self.navegar(pagina)
+        if pagina == "Relatórios":
+            self._rerun(_widget(self.at.button, "Gerar Excel").click().run)
+
+    def escrever(self):
+        """Lança (ou atualiza) a contribuição de um membro no ano corrente."""
+        self.navegar("Página Financeira")
+        try:
+            membro = _widget(self.at.selectbox, "Membro*")
+        except LookupError:
+            return self.ler()  # sem membros cadastrados: não há o que lançar
+        membro.select_index(self.rng.randrange(len(membro.options)))
+        _widget(self.at.selectbox, "Mês (competência)*").select_index(self.rng.randrange(12))
+        _widget(self.at.number_input, "Valor do dízimo (R$)*").set_value(float(self.rng.randint(10, 500)))
+        self._rerun(_widget(self.at.button, "Salvar / Atualizar").click().run)
+
+    def executar(self, acoes, escrita):
+        self.login()
+        for _ in range(acoes):
+            if self.perfil == "tesouraria" and self.rng.random() < escrita:
+                self.escrever()
+            else:
+                self.ler()
+
+
+_BARREIRA = None
+
+
+def _iniciar_processo(barreira):
+    global _BARREIRA
+    _BARREIRA = barreira
+
+
+def _sem_sessao(erro):
+    agora = time.time()
+    return {"latencias": [], "erros": 1, "ultimo_erro": erro, "inicio": agora, "fim": agora, "pico": None}
+
+
+def _rodar_sessao(perfil, secrets, tenant, semente, acoes, escrita, medir_memoria):
+    """Executa uma sessão no processo do pool e devolve as medições dela."""
+    try:
+        sessao = SessaoSimulada(perfil, secrets, tenant, random.Random(semente))
+    except Exception as e:
+        _BARREIRA.abort()  # libera as sessões que já esperam na barreira
+        return _sem_sessao(f"sessão não iniciou: {e!r}")
+    if medir_memoria:
+        tracemalloc.start()
+    try:
+        _BARREIRA.wait(timeout=TIMEOUT_BARREIRA)
+    except threading.BrokenBarrierError:
+        return _sem_sessao("barreira rompida: outra sessão não iniciou (ou demorou demais)")
+    inicio = time.time()
+    try:
+        sessao.executar(acoes, escrita)
+    except Exception as e:
+        sessao.erros += 1
+        sessao.ultimo_erro = repr(e)
+    fim = time.time()
+    pico = tracemalloc.get_traced_memory()[1] if medir_memoria else None
+    return {"latencias": sessao.latencias, "erros": sessao.erros, "ultimo_erro": sessao.ultimo_erro,
+            "inicio": inicio, "fim": fim, "pico": pico}
+
+
+def _percentil(valores, p):
+    return float(pd.Series(valores).quantile(p / 100)) if valores else float("nan")
+
+
+def rodar_cenario(sessoes, acoes, escrita, secrets, tenant, proporcao_tesouraria, medir_memoria, semente):
+    """Roda 'sessoes' sessões simultâneas e devolve as métricas do cenário."""
+    rng = random.Random(semente)
+    perfis = ["tesouraria" if rng.random() < proporcao_tesouraria else "secretaria" for _ in range(sessoes)]
+    contexto = multiprocessing.get_context("spawn")
+    barreira = contexto.Barrier(sessoes)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=sessoes, mp_context=contexto, initializer=_iniciar_processo, initargs=(barreira,)
+    ) as pool:
+        futuros = [
+            pool.submit(_rodar_sessao, p, secrets, tenant, semente + i, acoes, escrita, medir_memoria)
+            for i, p in enumerate(perfis)
+        ]
+        resultados = [f.result() for f in futuros]
+
+    latencias = [t for r in resultados for t in r["latencias"]]
+    duracao = max(r["fim"] for r in resultados) - min(r["inicio"] for r in resultados)
+    picos = [r["pico"] for r in resultados if r["pico"] is not None]
+    return {
+        "sessoes": sessoes,
+        "tesouraria": perfis.count("tesouraria"),
+        "reruns": len(latencias),
+        "erros": sum(r["erros"] for r in resultados),
+        "p50_ms": _percentil(latencias, 50) * 1000,
+        "p95_ms": _percentil(latencias, 95) * 1000,
+        "p99_ms": _percentil(latencias, 99) * 1000,
+        "reruns_por_s": len(latencias) / duracao if duracao else float("nan"),
+        "pico_memoria_mb": sum(picos) / 1_048_576 if picos else float("nan"),
+        "ultimo_erro": next((r["ultimo_erro"] for r in resultados if r["ultimo_erro"]), None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--config", required=True, help="TOML com a conexão do banco substituto local")
+    parser.add_argument("--tenant", help="igreja usada pelas sessões (padrão: a única configurada)")
+    parser.add_argument("--sessoes", default="1,5,10", help="níveis de concorrência (um cenário por nível)")
+    parser.add_argument("--acoes", type=int, default=20, help="ações por sessão, além do login")
+    parser.add_argument("--escrita", type=float, default=0.2, help="fração das ações da tesouraria que gravam")
+    parser.add_argument("--tesouraria", type=float, default=0.5, help="fração de sessões da tesouraria")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--sem-memoria", action="store_true", help="não usa tracemalloc (menos overhead)")
+    parser.add_argument("--csv", help="grava o resultado também em CSV")
+    args = parser.parse_args(argv)
+
+    secrets = dados.carregar_config(args.config)
+    tenant = args.tenant or dados.tenant_atual()
+
+    linhas = []
+    for n in [int(x) for x in args.sessoes.split(",")]:
+        linha = rodar_cenario(n, args.acoes, args.escrita, secrets, tenant,
+                              args.tesouraria, not args.sem_memoria, args.semente)
+        linha["escrita"] = args.escrita
+        linhas.append(linha)
+        print(
+            f"{n:>3} sessões: p50 {linha['p50_ms']:.0f} ms | p95 {linha['p95_ms']:.0f} ms | "
+            f"p99 {linha['p99_ms']:.0f} ms | {linha['reruns_por_s']:.1f} reruns/s | "
+            f"pico {linha['pico_memoria_mb']:.1f} MB | erros {linha['erros']}",
+            flush=True,
+        )
+        if linha["ultimo_erro"]:
+            print(f"      último erro: {linha['ultimo_erro']}", flush=True)
+
+    resultado = pd.DataFrame(linhas)
+    if args.csv:
+        resultado.to_csv(args.csv, index=False)
+    return 1 if resultado["erros"].any() else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
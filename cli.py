@@ -0,0 +1,327 @@
+"""
+Linha de comando do sistema da igreja: exportações, documentos em lote e
+rotinas de manutenção sem subir o Streamlit (por exemplo, agendadas no cron).
+
+A conexão vem do mesmo TOML do .streamlit/secrets.toml (--config ou
+$IGREJA_CONFIG) e/ou das variáveis IGREJA_SERVER, IGREJA_DATABASE,
+IGREJA_USERNAME e IGREJA_PASSWORD.
+
+Exemplos:
+    python cli.py exportar-membros --saida membros.xlsx
+    python cli.py --tenant sede exportar-painel --ano 2025
+    python cli.py --todas cartas-ausencia --meses 3
+    python cli.py --todas manter-particoes
+    python cli.py --todas exportar-fotos
+    python cli.py duplicados
+    python cli.py mesclar-membros --manter 12 --remover 345
+    python cli.py medir-inicio --limite 3
+"""
+import argparse
+import datetime
+import logging
+import pathlib
+import statistics
+import subprocess
+import sys
+
+import dados
+import duplicados
+import imagens
+import relatorios
+
+logger = logging.getLogger("igreja.cli")
+
+
+class ErroBanco(Exception):
+    """Falha de leitura/conexão relatada pela camada de dados."""
+
+
+def _falhar(mensagem):
+    # Na aplicação um erro de leitura vira st.error e um DataFrame vazio; aqui
+    # interrompe o comando: um agendamento não pode gravar um arquivo vazio por
+    # cima da última exportação nem sair com 0 com o banco fora do ar.
+    raise ErroBanco(mensagem)
+
+
+def _gravar(conteudo, saida, tenant):
+    caminho = pathlib.Path(saida.format(tenant=tenant))
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    caminho.write_bytes(conteudo)
+    logger.info("[%s] arquivo gravado: %s", tenant, caminho)
+
+
+def exportar_membros(args, tenant):
+    membros = dados.carregar_membros_sem_foto(tenant=tenant)
+    _gravar(relatorios.excel_bytes(membros, "Membros"), args.saida, tenant)
+    return True
+
+
+def exportar_painel(args, tenant):
+    dados.ensure_finance_schema(tenant)
+    df = dados.carregar_painel(args.ano, tenant=tenant)
+    if df.empty:
+        logger.info("[%s] sem lançamentos em %s.", tenant, args.ano)
+        return True
+    painel = relatorios.montar_painel(df)
+    _gravar(relatorios.painel_excel_bytes(painel, args.ano), args.saida, tenant)
+    return True
+
+
+def cartas_ausencia(args, tenant):
+    ausentes = dados.detectar_ausentes(args.meses, tenant=tenant)
+    logger.info("[%s] %d membro(s) ausente(s).", tenant, len(ausentes))
+    if ausentes.empty:
+        return True
+    nome_igreja = dados.tenant_config(tenant).get("nome", tenant)
+    _gravar(relatorios.gerar_cartas_ausencia_pdf(ausentes, nome_igreja), args.saida, tenant)
+    return True
+
+
+def exportar_conciliacao(args, tenant):
+    dados.ensure_finance_schema(tenant)
+    linhas = dados.carregar_conciliacao(args.ano, tenant=tenant)
+    if linhas.empty:
+        logger.info("[%s] sem lançamentos em %s.", tenant, args.ano)
+        return True
+    conciliacao = relatorios.montar_conciliacao(linhas)
+    _gravar(relatorios.conciliacao_excel_bytes(conciliacao, args.ano), args.saida, tenant)
+    return True
+
+
+def fechar_periodo(args, tenant):
+    dados.ensure_finance_schema(tenant)
+    ok = dados.fechar_periodo(args.ano, tenant=tenant)
+    if ok is not True:
+        logger.error("[%s] falha ao fechar %s: %s", tenant, args.ano, ok)
+        return False
+    dados.painel_snapshot(args.ano, tenant=tenant)  # já grava o arquivo local
+    logger.info("[%s] período %s fechado.", tenant, args.ano)
+    return True
+
+
+def manter_particoes(args, tenant):
+    dados.ensure_finance_schema(tenant)
+    ok = dados.manter_particoes_financeiras(args.anos_a_frente, tenant=tenant)
+    if ok is not True:
+        logger.error("[%s] falha ao criar partições: %s", tenant, ok)
+        return False
+    return True
+
+
+def particionar_lancamentos(args, tenant):
+    ok = dados.particionar_lancamentos(tenant=tenant)
+    if ok is not True:
+        logger.error("[%s] falha ao particionar DizimoLancamentos: %s", tenant, ok)
+        return False
+    logger.info("[%s] DizimoLancamentos particionada por ano.", tenant)
+    return True
+
+
+def reprocessar_imagens(args, tenant):
+    qtd, antes, depois = imagens.reprocessar_imagens(args.limite_kb * 1024, tenant=tenant)
+    logger.info(
+        "[%s] %d imagem(ns) recodificada(s): %.1f MB -> %.1f MB",
+        tenant, qtd, antes / 1_048_576, depois / 1_048_576,
+    )
+    return True
+
+
+def exportar_fotos(args, tenant):
+    destino = args.saida.format(tenant=tenant)
+    qtd, total = imagens.exportar_fotos_zip(destino, lote=args.lote, tenant=tenant)
+    logger.info("[%s] %d foto(s) (%.1f MB) em %s", tenant, qtd, total / 1_048_576, destino)
+    return True
+
+
+def restaurar_fotos(args, tenant):
+    restauradas, ignoradas = imagens.restaurar_fotos_zip(
+        args.arquivo.format(tenant=tenant), somente_sem_foto=args.somente_sem_foto,
+        lote=args.lote, tenant=tenant,
+    )
+    logger.info("[%s] %d foto(s) restaurada(s), %d ignorada(s).", tenant, restauradas, ignoradas)
+    return True
+
+
+def listar_duplicados(args, tenant):
+    pares = duplicados.detectar_duplicados(tenant=tenant)
+    logger.info("[%s] %d par(es) provável(is) de duplicados.", tenant, len(pares))
+    if pares.empty:
+        return True
+    _gravar(relatorios.excel_bytes(pares, "Duplicados"), args.saida, tenant)
+    return True
+
+
+def mesclar_membros(args, tenant):
+    ok = duplicados.mesclar_membros(args.manter, args.remover, tenant=tenant)
+    if ok is not True:
+        logger.error("[%s] falha ao mesclar %s em %s: %s", tenant, args.remover, args.manter, ok)
+        return False
+    logger.info("[%s] membro %s mesclado em %s.", tenant, args.remover, args.manter)
+    return True
+
+
+def listar_tenants(args, tenant):
+    print(f"{tenant}\t{dados.tenant_config(tenant).get('nome', '')}")
+    return True
+
+
+# Módulos que só devem carregar sob demanda; se aparecerem no import do app,
+# alguém voltou a importá-los no topo de um módulo. O pyarrow não entra: o
+# pandas e o Streamlit já o importam.
+MODULOS_SOB_DEMANDA = ("fpdf", "docx", "lxml", "PIL", "arrow_odbc", "xlsxwriter")
+
+_SONDA_IMPORT = (
+    "import sys, time\n"
+    "t = time.perf_counter()\n"
+    "import {modulo}\n"
+    "print(time.perf_counter() - t)\n"
+    "print(' '.join(m for m in {pesados!r} if m in sys.modules))\n"
+)
+
+
+def medir_inicio(args, tenant=None):
+    """
+    Mede o import do app em interpretadores novos (como num cold start) e
+    falha se a mediana passar de --limite ou se algum módulo de
+    MODULOS_SOB_DEMANDA for carregado já no import.
+    """
+    codigo = _SONDA_IMPORT.format(modulo=args.modulo, pesados=MODULOS_SOB_DEMANDA)
+    tempos, carregados = [], set()
+    for _ in range(args.repeticoes):
+        saida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=pathlib.Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True,
+        ).stdout.splitlines()
+        tempos.append(float(saida[0]))
+        carregados.update(saida[1].split() if len(saida) > 1 else [])
+    mediana = statistics.median(tempos)
+    print(f"import {args.modulo}: mediana {mediana:.3f}s, máx {max(tempos):.3f}s ({args.repeticoes} execuções)")
+    ok = True
+    if carregados:
+        print("carregados no import (deveriam ser sob demanda): " + ", ".join(sorted(carregados)))
+        ok = False
+    if args.limite and mediana > args.limite:
+        print(f"acima do limite de {args.limite:.3f}s")
+        ok = False
+    return ok
+
+
+def criar_parser():
+    ano_atual = datetime.date.today().year
+    parser = argparse.ArgumentParser(prog="cli.py", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--config", help="arquivo TOML de configuração (padrão: $IGREJA_CONFIG ou .streamlit/secrets.toml)")
+    alvo = parser.add_mutually_exclusive_group()
+    alvo.add_argument("--tenant", help="chave da igreja (obrigatória se houver mais de uma)")
+    alvo.add_argument("--todas", action="store_true", help="executa para todas as igrejas configuradas")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("exportar-membros", help="Excel com os membros cadastrados")
+    p.add_argument("--saida", default="saida/{tenant}/relatorio_membros.xlsx")
+    p.set_defaults(func=exportar_membros)
+
+    p = sub.add_parser("exportar-painel", help="Excel do painel anual de dizimistas")
+    p.add_argument("--ano", type=int, default=ano_atual)
+    p.add_argument("--saida", default="saida/{tenant}/painel_dizimistas_{ano}.xlsx")
+    p.set_defaults(func=exportar_painel)
+
+    p = sub.add_parser("exportar-conciliacao", help="Excel da conciliação financeira do ano")
+    p.add_argument("--ano", type=int, default=ano_atual)
+    p.add_argument("--saida", default="saida/{tenant}/conciliacao_{ano}.xlsx")
+    p.set_defaults(func=exportar_conciliacao)
+
+    p = sub.add_parser("cartas-ausencia", help="PDF com as Cartas por Ausência dos membros ausentes")
+    p.add_argument("--meses", type=int, default=3)
+    p.add_argument("--saida", default="saida/{tenant}/cartas_ausencia.pdf")
+    p.set_defaults(func=cartas_ausencia)
+
+    p = sub.add_parser("fechar-periodo", help="fecha um ano e grava o snapshot do painel")
+    p.add_argument("--ano", type=int, required=True)
+    p.set_defaults(func=fechar_periodo)
+
+    p = sub.add_parser("manter-particoes", help="cria com antecedência as partições anuais")
+    p.add_argument("--anos-a-frente", type=int, default=1)
+    p.set_defaults(func=manter_particoes)
+
+    p = sub.add_parser("particionar-lancamentos",
+                       help="migra a DizimoLancamentos antiga para o particionamento por ano (reescreve a tabela)")
+    p.set_defaults(func=particionar_lancamentos)
+
+    p = sub.add_parser("reprocessar-imagens", help="recodifica fotos/logotipos já gravados")
+    p.add_argument("--limite-kb", type=int, default=200)
+    p.set_defaults(func=reprocessar_imagens)
+
+    p = sub.add_parser("exportar-fotos", help="backup das fotos dos membros em ZIP (em fluxo)")
+    p.add_argument("--saida", default="saida/{tenant}/fotos_membros.zip")
+    p.add_argument("--lote", type=int, default=imagens.LOTE_FOTOS)
+    p.set_defaults(func=exportar_fotos)
+
+    p = sub.add_parser("restaurar-fotos", help="restaura as fotos de um ZIP de exportar-fotos")
+    p.add_argument("--arquivo", required=True)
+    p.add_argument("--somente-sem-foto", action="store_true", help="não sobrescreve fotos existentes")
+    p.add_argument("--lote", type=int, default=imagens.LOTE_FOTOS)
+    p.set_defaults(func=restaurar_fotos)
+
+    p = sub.add_parser("duplicados", help="Excel com os pares prováveis de membros duplicados")
+    p.add_argument("--saida", default="saida/{tenant}/membros_duplicados.xlsx")
+    p.set_defaults(func=listar_duplicados)
+
+    p = sub.add_parser("mesclar-membros", help="mescla um cadastro duplicado em outro")
+    p.add_argument("--manter", type=int, required=True, help="id do cadastro que fica")
+    p.add_argument("--remover", type=int, required=True, help="id do cadastro duplicado (excluído)")
+    p.set_defaults(func=mesclar_membros)
+
+    p = sub.add_parser("medir-inicio", help="mede o tempo de import do app (cold start)")
+    p.add_argument("--modulo", default="demo")
+    p.add_argument("--repeticoes", type=int, default=5)
+    p.add_argument("--limite", type=float, default=None, help="segundos; acima disso sai com erro")
+    p.set_defaults(func=medir_inicio, sem_banco=True)
+
+    p = sub.add_parser("tenants", help="lista as igrejas configuradas")
+    p.set_defaults(func=listar_tenants, todas=True)
+
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if getattr(args, "sem_banco", False):
+        return 0 if args.func(args) else 1
+
+    dados.carregar_config(args.config)
+    dados.reportar_erro = _falhar
+    try:
+        todas = dados.tenants()
+    except KeyError as e:
+        logger.error("Configuração incompleta: %s (use --config ou IGREJA_SERVER, IGREJA_DATABASE...)", e.args[0])
+        return 2
+    if args.todas:
+        alvos = list(todas)
+    elif args.tenant:
+        alvos = [args.tenant]
+    elif len(todas) == 1:
+        alvos = list(todas)
+    else:
+        logger.error("Há várias igrejas configuradas: use --tenant <chave> ou --todas.")
+        return 2
+
+    if getattr(args, "saida", None):
+        args.saida = args.saida.replace("{ano}", str(getattr(args, "ano", "")))
+
+    falhas = 0
+    for tenant in alvos:
+        dados.origem_tenant = lambda: tenant
+        try:
+            if not args.func(args, tenant):
+                falhas += 1
+        except ErroBanco as e:
+            logger.error("[%s] falha em %s: %s", tenant, args.comando, e)
+            falhas += 1
+        except Exception:
+            logger.exception("[%s] falha em %s", tenant, args.comando)
+            falhas += 1
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1358 @@
+"""
+Camada de dados do sistema da igreja, sem dependência do Streamlit.
+
+Usada pela aplicação (demo.py) e pela linha de comando (cli.py): configuração
+das igrejas (tenants), conexão resiliente ao SQL Server, leituras/escritas,
+cache por igreja, esquema financeiro e rotinas sobre os lançamentos.
+"""
+import collections
+import datetime
+import logging
+import os
+import pathlib
+import random
+import re
+import threading
+import time
+
+import pandas as pd
+import pyodbc
+
+# Leitura colunar opcional (pip install arrow-odbc): busca resultados direto em
+# Arrow. O módulo só é importado na primeira leitura colunar (_importar_arrow),
+# junto com o driver que ele carrega. O pyarrow em si já vem com o pandas e o
+# Streamlit, então não pesa no login.
+arrow_odbc = None
+pa = None
+_ARROW_VERIFICADO = False
+
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Configuração
+# -----------------------------------------------------------------------------
+# Mesmo formato do .streamlit/secrets.toml. A aplicação Streamlit repassa
+# st.secrets com configurar(); fora dele, carregar_config() lê um arquivo TOML
+# e/ou variáveis de ambiente IGREJA_<CHAVE> (IGREJA_SERVER, IGREJA_DATABASE...).
+
+_CONFIG = {}
+
+
+def configurar(cfg):
+    """Define a configuração (dict no formato do secrets.toml)."""
+    global _CONFIG
+    _CONFIG = dict(cfg)
+
+
+def config(chave, padrao=None):
+    return _CONFIG.get(chave, padrao)
+
+
+def carregar_config(caminho=None):
+    """
+    Carrega a configuração de um arquivo TOML (caminho, $IGREJA_CONFIG ou
+    .streamlit/secrets.toml) e completa/sobrescreve a raiz com IGREJA_<CHAVE>.
+    """
+    import tomllib
+
+    caminho = caminho or os.environ.get("IGREJA_CONFIG") or ".streamlit/secrets.toml"
+    cfg = {}
+    if pathlib.Path(caminho).exists():
+        with open(caminho, "rb") as f:
+            cfg = tomllib.load(f)
+    for chave in CHAVES_CONEXAO + tuple(PADROES_CONEXAO) + ("nome_igreja", "snapshot_dir", "backup_dir"):
+        valor = os.environ.get(f"IGREJA_{chave.upper()}")
+        if valor is not None:
+            cfg[chave] = valor
+    configurar(cfg)
+    return cfg
+
+
+def _sem_tenant():
+    return None
+
+
+def _log_erro(mensagem):
+    logger.error(mensagem)
+
+
+_SESSAO_PROCESSO = {}
+
+
+def _sessao_processo():
+    return _SESSAO_PROCESSO
+
+
+# Ganchos definidos por quem usa a camada: a aplicação Streamlit devolve a
+# igreja da sessão e mostra os erros com st.error; a CLI fixa a igreja pedida.
+# origem_sessao devolve o estado (dict) da sessão do usuário, onde fica o
+# instante da última escrita dela (ler o que gravou); fora do Streamlit o
+# processo inteiro é uma sessão.
+origem_tenant = _sem_tenant
+reportar_erro = _log_erro
+origem_sessao = _sessao_processo
+
+
+# -----------------------------------------------------------------------------
+# Igrejas (tenants): cada igreja tem sua chave e seu próprio banco
+# -----------------------------------------------------------------------------
+# Na configuração (st.secrets ou arquivo TOML), uma seção por igreja:
+#
+#   [tenants.sede]
+#   nome = "Igreja Sede"
+#   server = "..."
+#   database = "..."
+#   username = "..."
+#   password = "..."
+#   schema = "dbo"            # opcional (schema padrão do login da igreja)
+#   [tenants.sede.usuarios]   # obrigatória com mais de uma igreja (senão vale CREDENTIALS)
+#   adm = "..."
+#
+# Sem a seção [tenants], vale a configuração única (server/database/...) na
+# raiz da configuração, com a chave TENANT_PADRAO. Cada igreja fica isolada no
+# seu banco (ou no schema padrão do seu login) e todo read_records /
+# execute_query é roteado para a igreja da sessão.
+
+TENANT_PADRAO = "padrao"
+CHAVES_CONEXAO = ("server", "database", "username", "password")
+
+# Pool de conexões do driver ODBC: uma conexão fechada volta ao pool da sua
+# connection string, ou seja, cada igreja tem o seu próprio pool.
+pyodbc.pooling = True
+
+
+def tenants():
+    """Retorna {chave: configuração} de todas as igrejas configuradas."""
+    if "tenants" in _CONFIG:
+        return {chave: dict(cfg) for chave, cfg in _CONFIG["tenants"].items()}
+    faltando = [k for k in CHAVES_CONEXAO if k not in _CONFIG]
+    if faltando:
+        raise KeyError(f"conexão não configurada (faltam: {', '.join(faltando)})")
+    cfg = {k: _CONFIG[k] for k in CHAVES_CONEXAO}
+    cfg["nome"] = _CONFIG.get("nome_igreja", "Igreja")
+    if "replica" in _CONFIG:
+        cfg["replica"] = dict(_CONFIG["replica"])
+    return {TENANT_PADRAO: cfg}
+
+
+def tenant_atual():
+    """Chave da igreja em uso; só assume uma igreja se houver apenas uma."""
+    tenant = origem_tenant()
+    if tenant:
+        return tenant
+    todas = tenants()
+    if len(todas) == 1:
+        return next(iter(todas))
+    raise RuntimeError("Nenhuma igreja selecionada para a sessão.")
+
+
+def tenant_config(tenant=None):
+    tenant = tenant or tenant_atual()
+    cfg = tenants().get(tenant)
+    if cfg is None:
+        raise KeyError(f"Igreja '{tenant}' não configurada.")
+    return cfg
+
+
+def tenant_schema(tenant=None):
+    return tenant_config(tenant).get("schema", "dbo")
+
+
+# -----------------------------------------------------------------------------
+# Conexão com banco de dados
+# -----------------------------------------------------------------------------
+
+def connection_string(tenant=None, replica=False):
+    cfg = tenant_config(tenant)
+    if replica:
+        # o que a réplica não definir (usuário, senha, banco...) vem do primário
+        cfg = {**cfg, **cfg["replica"]}
+    server = cfg["server"]
+    database = cfg["database"]
+    username = cfg["username"]
+    password = cfg["password"]
+    driver = '{ODBC Driver 17 for SQL Server}'
+    cs = 'Driver='+ driver + ';Server='+ server + ';Database=' + database + ';Uid=' + username + ';Pwd={' + password + '}'
+    if replica:
+        cs += ';ApplicationIntent=ReadOnly'  # num listener Always On, vai para a secundária legível
+    return cs
+
+
+# -----------------------------------------------------------------------------
+# Conexão resiliente: timeouts, novas tentativas e circuit breaker
+# -----------------------------------------------------------------------------
+# Parâmetros opcionais na configuração (na raiz ou na seção da igreja):
+#   timeout_conexao = 5       # segundos para abrir a conexão (login)
+#   timeout_consulta = 10     # segundos por comando SQL
+#   tentativas_conexao = 3    # tentativas em erros transitórios
+#   falhas_para_abrir = 3     # falhas seguidas que abrem o circuito
+#   pausa_circuito = 30       # segundos com o circuito aberto
+#
+# Com o circuito aberto as conexões falham na hora (sem esperar o driver);
+# passada a pausa, uma única tentativa é liberada para testar o banco.
+# Timeouts e quedas durante a consulta (servidor lento que ainda aceita
+# conexões) também contam como falha.
+
+PADROES_CONEXAO = {
+    "timeout_conexao": 5,
+    "timeout_consulta": 10,
+    "tentativas_conexao": 3,
+    "falhas_para_abrir": 3,
+    "pausa_circuito": 30,
+}
+ESPERA_BASE = 0.2   # segundos; dobra a cada tentativa
+ESPERA_MAXIMA = 2.0
+
+# SQLSTATE / números de erro do SQL Server considerados transitórios
+ERROS_TRANSITORIOS = (
+    "08001", "08S01", "HYT00", "HYT01",
+    "4060", "40197", "40501", "40613", "49918", "49919", "49920", "10928", "10929",
+)
+
+
+def config_conexao(chave, tenant=None):
+    cfg = tenant_config(tenant)
+    if chave in cfg:
+        return cfg[chave]
+    return config(chave, PADROES_CONEXAO[chave])
+
+
+# pyodbc: args = (SQLSTATE, "[SQLSTATE] ... mensagem (número nativo) (SQLFunção)")
+_NATIVO_PYODBC = re.compile(r"\((\d+)\) \(SQL\w+\)")
+# arrow-odbc: "... State: HYT00, Native error: 0, Message: ..."
+_ESTADO_ARROW_ODBC = re.compile(r"State: (\w{5}), Native error: (-?\d+)")
+
+
+def _codigos_erro(erro):
+    """SQLSTATE e números nativos do erro do driver (também se vier embrulhado, ex.: pandas)."""
+    while erro.__cause__ is not None and not isinstance(erro, pyodbc.Error):
+        erro = erro.__cause__
+    args = getattr(erro, "args", ())
+    if isinstance(erro, pyodbc.Error) and args:
+        codigos = {str(args[0])}
+        if len(args) > 1:
+            codigos.update(_NATIVO_PYODBC.findall(str(args[1])))
+        return codigos
+    codigos = set()
+    for estado, nativo in _ESTADO_ARROW_ODBC.findall(" ".join(str(a) for a in args)):
+        codigos.update((estado, nativo))
+    return codigos
+
+
+def _erro_transitorio(erro):
+    return not _codigos_erro(erro).isdisjoint(ERROS_TRANSITORIOS)
+
+
+class CircuitBreaker:
+    """
+    Conta falhas seguidas (de conexão ou de consulta) e bloqueia novas
+    tentativas por um tempo. Só uma consulta bem-sucedida zera a contagem:
+    num servidor lento as conexões abrem, mas as consultas estouram o tempo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self.ultimo_erro = None
+
+    def permitir(self, pausa):
+        with self._lock:
+            agora = time.monotonic()
+            if agora < self.aberto_ate:
+                return False
+            if self.aberto_ate:
+                # meio-aberto: libera só esta tentativa e segura as demais
+                self.aberto_ate = agora + pausa
+            return True
+
+    def sucesso(self):
+        with self._lock:
+            self.falhas = 0
+            self.aberto_ate = 0.0
+
+    def conectado(self):
+        # a conexão abriu: fecha o circuito, mas mantém a contagem até a
+        # consulta dar certo (se falhar de novo, o circuito reabre na hora)
+        with self._lock:
+            self.aberto_ate = 0.0
+
+    def falha(self, erro, falhas_para_abrir, pausa):
+        with self._lock:
+            self.falhas += 1
+            self.ultimo_erro = str(erro)
+            if self.falhas >= falhas_para_abrir:
+                self.aberto_ate = time.monotonic() + pausa
+
+    def estado(self):
+        with self._lock:
+            restante = self.aberto_ate - time.monotonic()
+            if not self.aberto_ate:
+                situacao = "fechado"
+            elif restante > 0:
+                situacao = "aberto"
+            else:
+                situacao = "meio-aberto"
+            return {
+                "situacao": situacao,
+                "falhas_seguidas": self.falhas,
+                "reabre_em_s": round(max(restante, 0.0), 1),
+                "ultimo_erro": self.ultimo_erro,
+            }
+
+
+_CIRCUITOS = collections.defaultdict(CircuitBreaker)
+
+
+def circuito(tenant=None, replica=False):
+    """Circuit breaker da igreja (compartilhado por todas as sessões do processo)."""
+    tenant = tenant or tenant_atual()
+    return _CIRCUITOS[(tenant, "replica") if replica else tenant]
+
+
+def conectar(tenant=None, replica=False):
+    """
+    Abre uma conexão com timeout de login e de consulta, repetindo erros
+    transitórios com espera exponencial + jitter. Levanta ConnectionError na
+    hora se o circuito da igreja estiver aberto. Na réplica não há novas
+    tentativas: quem lê dela cai direto para o primário.
+    """
+    tenant = tenant or tenant_atual()
+    cb = circuito(tenant, replica)
+    pausa = float(config_conexao("pausa_circuito", tenant))
+    limite = int(config_conexao("falhas_para_abrir", tenant))
+    tentativas = 1 if replica else max(1, int(config_conexao("tentativas_conexao", tenant)))
+    for tentativa in range(tentativas):
+        if not cb.permitir(pausa):
+            raise ConnectionError(
+                f"Banco de dados indisponível (nova tentativa em {cb.estado()['reabre_em_s']:.0f}s)."
+            )
+        try:
+            conx = pyodbc.connect(connection_string(tenant, replica), timeout=int(config_conexao("timeout_conexao", tenant)))
+            conx.timeout = int(config_conexao("timeout_consulta", tenant))
+            cb.conectado()
+            return conx
+        except pyodbc.Error as e:
+            cb.falha(e, limite, pausa)
+            if not _erro_transitorio(e) or tentativa == tentativas - 1:
+                raise
+            time.sleep(min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** tentativa) * random.uniform(0.5, 1.0))
+
+
+def falha_consulta(erro, tenant=None, replica=False):
+    """Conta no circuito da igreja um erro transitório ocorrido durante a consulta."""
+    if _erro_transitorio(erro):
+        tenant = tenant or tenant_atual()
+        circuito(tenant, replica).falha(
+            erro, int(config_conexao("falhas_para_abrir", tenant)), float(config_conexao("pausa_circuito", tenant))
+        )
+
+
+def get_connection(tenant=None):
+    try:
+        conx = conectar(tenant)
+        return conx
+    except Exception as e:
+        reportar_erro(f"Erro ao conectar ao banco de dados: {e}")
+        return None
+
+
+# -----------------------------------------------------------------------------
+# Réplica de leitura (opcional)
+# -----------------------------------------------------------------------------
+# Uma subseção "replica" na seção da igreja (ou na raiz, sem [tenants]); o que
+# ela não definir vem do primário:
+#
+#   [tenants.sede.replica]
+#   server = "replica.exemplo"
+#   atraso_maximo = 30            # s; réplica mais atrasada que isso não é usada
+#   janela_leitura_escrita = 10   # s após uma escrita lendo só do primário
+#   consulta_atraso = "..."       # SELECT que devolve o atraso em s (obrigatória fora do Always On)
+#
+# read_records/read_cached (listagens, painel, relatórios) vão para a réplica;
+# execute_query, execute_lote, read_records_lote e read_records(primario=True)
+# vão para o primário. A réplica tem circuit breaker próprio. Lê-se do
+# primário quando a réplica está fora do ar, atrasada, falha na consulta ou
+# quando a própria sessão acabou de gravar (para ver o que gravou); escritas
+# de outras sessões não tiram ninguém da réplica, só invalidam o cache.
+# Atraso desconhecido (sem linha na DMV do Always On, sem permissão para lê-la)
+# conta como réplica atrasada: log shipping, replicação ou um segundo banco
+# local de testes precisam de consulta_atraso (por exemplo, a idade de uma
+# tabela de pulsação atualizada no primário).
+
+ATRASO_MAXIMO_REPLICA = 30
+JANELA_LEITURA_ESCRITA = 10
+VERIFICACAO_ATRASO = 15   # s entre duas medições do atraso da réplica
+
+# Atraso da própria base numa secundária legível do Always On; sem linhas
+# (réplica fora de um grupo de disponibilidade) o atraso é desconhecido.
+QUERY_ATRASO_REPLICA = """
+    SELECT MAX(secondary_lag_seconds)
+      FROM sys.dm_hadr_database_replica_states
+     WHERE is_local = 1 AND database_id = DB_ID()
+"""
+
+_ULTIMA_ESCRITA = {}   # tenant -> instante (monotonic) da última escrita do processo
+_ATRASOS = {}          # tenant -> (instante da medição, atraso em s)
+_REPLICA_LOCK = threading.Lock()
+
+
+def replica_config(tenant=None):
+    return tenant_config(tenant).get("replica")
+
+
+def registrar_escrita(tenant=None):
+    tenant = tenant or tenant_atual()
+    agora = time.monotonic()
+    with _REPLICA_LOCK:
+        _ULTIMA_ESCRITA[tenant] = agora
+    sessao = origem_sessao()
+    if sessao is not None:
+        sessao[f"ultima_escrita_{tenant}"] = agora
+
+
+def ultima_escrita_sessao(tenant=None):
+    """Instante (monotonic) da última escrita da sessão atual na igreja, ou None."""
+    sessao = origem_sessao()
+    if sessao is None:
+        return None
+    return sessao.get(f"ultima_escrita_{tenant or tenant_atual()}")
+
+
+def atraso_replica(tenant=None):
+    """Atraso da réplica em segundos (inf se inacessível), medido no máximo a cada VERIFICACAO_ATRASO s."""
+    tenant = tenant or tenant_atual()
+    agora = time.monotonic()
+    with _REPLICA_LOCK:
+        medido = _ATRASOS.get(tenant)
+    if medido and agora - medido[0] < VERIFICACAO_ATRASO:
+        return medido[1]
+    try:
+        conx = conectar(tenant, replica=True)
+    except Exception as e:
+        logger.warning("Réplica da igreja %s inacessível: %s", tenant, e)
+        atraso = float("inf")
+    else:
+        try:
+            consulta = replica_config(tenant).get("consulta_atraso", QUERY_ATRASO_REPLICA)
+            row = conx.cursor().execute(consulta).fetchone()
+            circuito(tenant, replica=True).sucesso()
+            if row and row[0] is not None:
+                atraso = float(row[0])
+            else:
+                logger.warning("Atraso da réplica da igreja %s desconhecido: configure consulta_atraso.", tenant)
+                atraso = float("inf")
+        except pyodbc.Error as e:
+            # sem VIEW SERVER STATE, por exemplo: sem medida, não usa a réplica
+            logger.warning("Atraso da réplica da igreja %s não verificado: %s", tenant, e)
+            atraso = float("inf")
+        finally:
+            conx.close()
+    with _REPLICA_LOCK:
+        _ATRASOS[tenant] = (agora, atraso)
+    return atraso
+
+
+def replica_em_dia(tenant, inicio):
+    """
+    Indica se uma leitura feita na réplica no instante 'inicio' (monotonic)
+    já inclui a última escrita deste processo na igreja, ou seja, se pode ir
+    para o cache sob a versão atual. O atraso pode ter crescido desde a última
+    medição: conta-se VERIFICACAO_ATRASO de folga.
+    """
+    with _REPLICA_LOCK:
+        ultima = _ULTIMA_ESCRITA.get(tenant)
+        medido = _ATRASOS.get(tenant)
+    if ultima is None:
+        return True
+    if medido is None:
+        return False
+    return ultima < inicio - medido[1] - VERIFICACAO_ATRASO
+
+
+def usar_replica(tenant=None):
+    """Indica se as leituras da sessão atual na igreja devem ir para a réplica agora."""
+    tenant = tenant or tenant_atual()
+    cfg = replica_config(tenant)
+    if not cfg:
+        return False
+    ultima = ultima_escrita_sessao(tenant)
+    janela = float(cfg.get("janela_leitura_escrita", JANELA_LEITURA_ESCRITA))
+    if ultima is not None and time.monotonic() - ultima < janela:
+        return False
+    if circuito(tenant, replica=True).estado()["situacao"] == "aberto":
+        return False
+    atraso = atraso_replica(tenant)
+    if atraso > float(cfg.get("atraso_maximo", ATRASO_MAXIMO_REPLICA)):
+        return False
+    # a réplica ainda pode não ter recebido a última escrita da sessão
+    return ultima is None or time.monotonic() - ultima >= atraso
+
+
+def estado_replica(tenant=None):
+    """Resumo para a Manutenção (None se a igreja não tiver réplica)."""
+    tenant = tenant or tenant_atual()
+    if not replica_config(tenant):
+        return None
+    with _REPLICA_LOCK:
+        medido = _ATRASOS.get(tenant)
+    return {
+        "em_uso": usar_replica(tenant),
+        "atraso_s": medido[1] if medido else None,
+        **circuito(tenant, replica=True).estado(),
+    }
+
+
+def _importar_arrow():
+    global arrow_odbc, pa, _ARROW_VERIFICADO
+    if not _ARROW_VERIFICADO:
+        try:
+            import arrow_odbc
+            import pyarrow as pa
+        except ImportError:
+            arrow_odbc = pa = None
+        _ARROW_VERIFICADO = True
+    return arrow_odbc is not None
+
+
+def arrow_disponivel():
+    """Indica se a leitura colunar (arrow-odbc) está instalada e habilitada na configuração."""
+    return bool(config("leitura_arrow", True)) and _importar_arrow()
+
+
+def _arrow_param(v):
+    # arrow-odbc só aceita parâmetros como texto; o SQL Server converte implicitamente
+    if v is None:
+        return None
+    if isinstance(v, (datetime.date, datetime.datetime)):
+        return v.isoformat()
+    return str(v)
+
+
+def read_records_arrow(query, params=None, tenant=None, replica=False):
+    """
+    Executa um SELECT buscando o resultado em lotes Arrow (colunar), sem
+    montar objetos Python linha a linha. Retorna um pyarrow.Table.
+    """
+    tenant = tenant or tenant_atual()
+    cb = circuito(tenant, replica)
+    pausa = float(config_conexao("pausa_circuito", tenant))
+    if not cb.permitir(pausa):
+        raise ConnectionError("Banco de dados indisponível (circuito aberto).")
+    try:
+        reader = arrow_odbc.read_arrow_batches_from_odbc(
+            query=query,
+            connection_string=connection_string(tenant, replica),
+            batch_size=10_000,
+            parameters=[_arrow_param(v) for v in params] if params else None,
+            max_text_size=4000,
+            login_timeout_sec=int(config_conexao("timeout_conexao", tenant)),
+            query_timeout_sec=int(config_conexao("timeout_consulta", tenant)),
+        )
+        tabela = pa.Table.from_batches(list(reader), schema=reader.schema)
+    except Exception as e:
+        if _erro_transitorio(e):
+            cb.falha(e, int(config_conexao("falhas_para_abrir", tenant)), pausa)
+        else:
+            cb.sucesso()  # o banco respondeu (erro na consulta): fecha o circuito meio-aberto
+        raise
+    cb.sucesso()
+    return tabela
+
+
+def _arrow_para_pandas(tabela):
+    """
+    Converte um pyarrow.Table em DataFrame com colunas apoiadas em Arrow
+    (pd.ArrowDtype), sem colunas 'object'. DECIMAL vira float64 para que
+    somas, pivots e o Excel tratem como número.
+    """
+    for i, campo in enumerate(tabela.schema):
+        if pa.types.is_decimal(campo.type):
+            tabela = tabela.set_column(i, campo.name, tabela.column(i).cast(pa.float64()))
+    return tabela.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _ler_replica(query, params, arrow, tenant):
+    if arrow and arrow_disponivel():
+        return _arrow_para_pandas(read_records_arrow(query, params, tenant=tenant, replica=True))
+    conx = conectar(tenant, replica=True)
+    try:
+        df = pd.read_sql(query, conx, params=params)
+    except Exception as e:
+        falha_consulta(e, tenant, replica=True)
+        raise
+    else:
+        circuito(tenant, replica=True).sucesso()
+        return df
+    finally:
+        conx.close()
+
+
+def read_records(query, params=None, arrow=False, tenant=None, primario=False):
+    """
+    Executa um SELECT e retorna um DataFrame.
+
+    Com arrow=True (e arrow-odbc instalado) o resultado vem do banco já em
+    colunas Arrow; caso contrário usa o caminho tradicional (pd.read_sql).
+    Use arrow=True apenas em consultas sem colunas binárias (fotos/logos).
+    Lê da réplica quando houver uma utilizável (ver usar_replica), senão
+    (ou com primario=True) do primário.
+    """
+    return _ler(query, params, arrow, tenant or tenant_atual(), primario)[0]
+
+
+def _ler(query, params, arrow, tenant, primario):
+    """read_records que também diz de onde veio o resultado: (df, da_replica)."""
+    if not primario and usar_replica(tenant):
+        try:
+            return _ler_replica(query, params, arrow, tenant), True
+        except Exception as e:
+            logger.warning("Leitura na réplica da igreja %s falhou, usando o primário: %s", tenant, e)
+
+    if arrow and arrow_disponivel():
+        try:
+            return _arrow_para_pandas(read_records_arrow(query, params, tenant=tenant)), False
+        except Exception as e:
+            reportar_erro(f"Erro ao ler registros: {e}")
+            return pd.DataFrame(), False
+
+    conx = get_connection(tenant)
+    if not conx:
+        return pd.DataFrame(), False
+    try:
+        df = pd.read_sql(query, conx, params=params)
+        circuito(tenant).sucesso()
+        return df, False
+    except Exception as e:
+        falha_consulta(e, tenant)
+        reportar_erro(f"Erro ao ler registros: {e}")
+        return pd.DataFrame(), False
+    finally:
+        conx.close()
+
+
+# -----------------------------------------------------------------------------
+# Cache de leituras por igreja
+# -----------------------------------------------------------------------------
+# Cada igreja tem um número de versão; toda escrita bem-sucedida incrementa a
+# versão da igreja e invalida só as leituras em cache dela.
+
+CACHE_TTL = 600          # segundos
+CACHE_MAX_ENTRADAS = 256
+
+_VERSOES_CACHE = collections.defaultdict(int)
+_CACHE = collections.OrderedDict()   # (tenant, versao, query, params, arrow) -> (instante, df)
+_CACHE_LOCK = threading.Lock()
+
+
+def invalidar_cache(tenant=None):
+    """Chamada após toda escrita: invalida o cache e abre a janela de leitura no primário da sessão."""
+    tenant = tenant or tenant_atual()
+    with _CACHE_LOCK:
+        _VERSOES_CACHE[tenant] += 1
+    registrar_escrita(tenant)
+
+
+def read_cached(query, params=None, tenant=None, arrow=False):
+    """
+    Como read_records, mas guarda o resultado em cache por igreja até a
+    próxima escrita dessa igreja (ou CACHE_TTL segundos). Cada chamada recebe
+    uma cópia, como no st.cache_data. arrow=True segue o mesmo critério de
+    read_records: só para consultas sem colunas binárias (fotos, logotipo).
+    """
+    tenant = tenant or tenant_atual()
+    params = tuple(params) if params else None
+    with _CACHE_LOCK:
+        chave = (tenant, _VERSOES_CACHE[tenant], query, params, arrow)
+        item = _CACHE.get(chave)
+        if item and time.monotonic() - item[0] < CACHE_TTL:
+            _CACHE.move_to_end(chave)
+            return item[1].copy()
+    inicio = time.monotonic()
+    df, da_replica = _ler(query, params, arrow, tenant, False)
+    # resultado vazio também vai para o cache (ex.: nenhum período fechado);
+    # não são guardadas a falha de leitura, que volta sem colunas, nem a
+    # leitura da réplica que ainda pode não ter a escrita que gerou a versão
+    if len(df.columns) and (not da_replica or replica_em_dia(tenant, inicio)):
+        with _CACHE_LOCK:
+            _CACHE[chave] = (time.monotonic(), df)
+            while len(_CACHE) > CACHE_MAX_ENTRADAS:
+                _CACHE.popitem(last=False)
+    return df.copy()
+
+
+# -----------------------------------------------------------------------------
+# Executa um comando SQL (INSERT, UPDATE ou DELETE) e confirma (commit)
+# -----------------------------------------------------------------------------
+
+def execute_query(query, params=None, tenant=None):
+    """
+    Executa um comando SQL (INSERT, UPDATE ou DELETE) e confirma (commit).
+    """
+    conx = get_connection(tenant)
+    if not conx:
+        return False
+    try:
+        cursor = conx.cursor()
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        conx.commit()
+        circuito(tenant).sucesso()
+        invalidar_cache(tenant)
+        if cursor.rowcount == 0:
+            return "Nenhuma linha foi afetada."
+        return True
+
+    except Exception as e:
+        falha_consulta(e, tenant)
+        error_message = str(e)
+        # Se achar "2627" ou "duplicate key", é chave duplicada
+        if "2627" in error_message or "duplicate key" in error_message:
+            return "Entrada duplicada."  # Mensagem genérica
+        else:
+            return error_message
+    finally:
+        conx.close()
+
+
+# -----------------------------------------------------------------------------
+# Operações em lote (lista de ids numa tabela temporária #ids)
+# -----------------------------------------------------------------------------
+
+def _carregar_ids(cursor, ids):
+    """Cria #ids na conexão e carrega a lista num único envio (fast_executemany)."""
+    cursor.execute("CREATE TABLE #ids (id INT PRIMARY KEY)")
+    cursor.fast_executemany = True
+    cursor.setinputsizes([(pyodbc.SQL_INTEGER, 0, 0)])
+    cursor.executemany("INSERT INTO #ids (id) VALUES (?)", [(int(i),) for i in set(ids)])
+
+
+def read_records_lote(query, ids, params=None, tenant=None):
+    """Executa um SELECT que usa #ids (a lista de ids) e retorna um DataFrame."""
+    conx = get_connection(tenant)
+    if not conx:
+        return pd.DataFrame()
+    try:
+        _carregar_ids(conx.cursor(), ids)
+        df = pd.read_sql(query, conx, params=params)
+        circuito(tenant).sucesso()
+        return df
+    except Exception as e:
+        falha_consulta(e, tenant)
+        reportar_erro(f"Erro ao ler registros: {e}")
+        return pd.DataFrame()
+    finally:
+        conx.close()
+
+
+def execute_lote(query, ids, params=None, tenant=None):
+    """
+    Executa um único UPDATE/DELETE set-based que usa #ids (a lista de ids),
+    numa só transação. Retorna o número de linhas afetadas (int) ou a
+    mensagem de erro (str); em caso de erro nada é gravado.
+    """
+    conx = get_connection(tenant)
+    if not conx:
+        return "Sem conexão com o banco de dados."
+    try:
+        cursor = conx.cursor()
+        _carregar_ids(cursor, ids)
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        afetadas = cursor.rowcount
+        conx.commit()
+        circuito(tenant).sucesso()
+        invalidar_cache(tenant)
+        return afetadas
+    except Exception as e:
+        falha_consulta(e, tenant)
+        try:
+            conx.rollback()
+        except pyodbc.Error:
+            pass  # conexão perdida (timeout/08S01): o servidor já desfez a transação
+        return str(e)
+    finally:
+        conx.close()
+
+
+# -----------------------------------------------------------------------------
+# Membros
+# -----------------------------------------------------------------------------
+
+# Esquema com PK 'id' e coluna 'matricula'
+COLUNAS_MEMBROS = [
+    "id", "matricula", "nome", "foto", "ministerio", "endereco",
+    "telefone", "email", "sexo", "data_nascimento", "estado_civil", "nome_conjuge",
+    "disciplina_data_ini", "disciplina_data_fim", "data_entrada",
+    "tipo_entrada", "data_desligamento", "motivo_desligamento",
+    "mes_aniversario"
+]
+# Colunas sem o blob da foto: usadas nas listagens/exportações (leitura Arrow)
+COLUNAS_MEMBROS_SEM_FOTO = [c for c in COLUNAS_MEMBROS if c != "foto"]
+
+# Leituras compartilhadas por todas as sessões (via read_cached); aquecer()
+# já as deixa no cache na subida do processo. As fotos ficam fora do cache:
+# são carregadas sob demanda (carregar_foto_membro / carregar_fotos_membros).
+QUERY_IGREJA = "SELECT * FROM Igreja"
+QUERY_MEMBROS = "SELECT " + ", ".join(COLUNAS_MEMBROS_SEM_FOTO) + " FROM Membros"
+QUERY_DIRETORIO_MEMBROS = "SELECT id, nome FROM Membros ORDER BY nome"
+
+
+# Ações em lote: um único comando set-based sobre os ids em #ids
+ACOES_LOTE_MEMBROS = {
+    "Desligar": """
+        UPDATE m SET data_desligamento = ?, motivo_desligamento = ?
+          FROM Membros m JOIN #ids i ON i.id = m.id
+    """,
+    "Reativar": """
+        UPDATE m SET data_desligamento = NULL, motivo_desligamento = 'Nenhum'
+          FROM Membros m JOIN #ids i ON i.id = m.id
+    """,
+    "Alterar ministério": """
+        UPDATE m SET ministerio = ?
+          FROM Membros m JOIN #ids i ON i.id = m.id
+    """,
+    "Excluir": """
+        DELETE m FROM Membros m JOIN #ids i ON i.id = m.id
+    """,
+}
+
+
+def carregar_membros_sem_foto(tenant=None):
+    """Membros sem o blob da foto (listagens e exportações)."""
+    return read_records(QUERY_MEMBROS, arrow=True, tenant=tenant)
+
+
+def carregar_foto_membro(membro_id, tenant=None):
+    """Bytes da foto de um membro (None se não tiver)."""
+    df = read_records("SELECT foto FROM Membros WHERE id = ?", params=(int(membro_id),), tenant=tenant)
+    if df.empty or df.at[0, "foto"] is None:
+        return None
+    return df.at[0, "foto"]
+
+
+def carregar_fotos_membros(tenant=None):
+    """id, nome e foto dos membros que têm foto (sem cache: só quando pedido)."""
+    return read_records(
+        "SELECT id, nome, foto FROM Membros WHERE foto IS NOT NULL ORDER BY nome", tenant=tenant
+    )
+
+
+# -----------------------------------------------------------------------------
+# Esquema financeiro (DizimoLancamentos e tabelas de fechamento)
+# -----------------------------------------------------------------------------
+
+_SCHEMAS_VERIFICADOS = set()
+
+
+def ensure_finance_schema(tenant=None):
+    """
+    Garante a existência da tabela/índices financeiros no SQL Server, no schema
+    da igreja. Roda uma vez por igreja enquanto o processo estiver no ar.
+    """
+    tenant = tenant or tenant_atual()
+    if tenant in _SCHEMAS_VERIFICADOS:
+        return
+    particao = "ON PS_DizimoAno([ano])" if _criar_particionamento(tenant) else ""
+    ddl = """
+    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[{schema}].[DizimoLancamentos]') AND type in (N'U'))
+    BEGIN
+        -- Agrupada por (ano, mes, id): o ano corrente fica em páginas (e,
+        -- com particionamento, numa partição) separadas do histórico
+        CREATE TABLE [{schema}].[DizimoLancamentos](
+            [id]                INT IDENTITY(1,1) NOT NULL,
+            [membro_id]         INT NOT NULL,
+            [competencia]       DATE NOT NULL,
+            [valor_dizimo]      DECIMAL(10,2) NOT NULL DEFAULT 0,
+            [valor_oferta]      DECIMAL(10,2) NOT NULL DEFAULT 0,
+            [data_pagamento]    DATE NOT NULL,
+            [forma_pagamento]   VARCHAR(30) NULL,
+            [observacoes]       NVARCHAR(255) NULL,
+            [criado_em]         DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+            [atualizado_em]     DATETIME2 NULL,
+            [ano]               AS (YEAR([competencia])) PERSISTED NOT NULL,
+            [mes]               AS (MONTH([competencia])) PERSISTED NOT NULL,
+            CONSTRAINT PK_DizimoLancamentos PRIMARY KEY CLUSTERED ([ano], [mes], [id])
+        ) {particao};
+        ALTER TABLE [{schema}].[DizimoLancamentos]
+            ADD CONSTRAINT FK_Dizimos_Membro
+            FOREIGN KEY ([membro_id]) REFERENCES [{schema}].[Membros]([id]) ON DELETE CASCADE;
+
+        CREATE UNIQUE INDEX UX_Dizimo_MembroCompetencia
+            ON [{schema}].[DizimoLancamentos]([membro_id], [ano], [mes]);
+
+        -- Exclusão/edição por id
+        CREATE INDEX IX_Dizimo_Id
+            ON [{schema}].[DizimoLancamentos]([id]);
+    END
+
+    -- Painel anual: WHERE ano = ? GROUP BY membro_id, mes
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Dizimo_Painel'
+                     AND object_id = OBJECT_ID(N'[{schema}].[DizimoLancamentos]'))
+        CREATE INDEX IX_Dizimo_Painel
+            ON [{schema}].[DizimoLancamentos]([ano], [membro_id], [mes])
+            INCLUDE ([valor_dizimo], [valor_oferta]);
+
+    -- Gerenciar lançamentos: WHERE ano = ? [AND mes = ?]. Nas tabelas novas o
+    -- índice agrupado (ano, mes, id) já cobre a consulta; só as tabelas
+    -- criadas antes (PK em id) precisam do índice de cobertura.
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name IN (N'IX_Dizimo_Lista', N'PK_DizimoLancamentos')
+                     AND object_id = OBJECT_ID(N'[{schema}].[DizimoLancamentos]'))
+        CREATE INDEX IX_Dizimo_Lista
+            ON [{schema}].[DizimoLancamentos]([ano], [mes])
+            INCLUDE ([membro_id], [valor_dizimo], [valor_oferta], [data_pagamento], [forma_pagamento], [observacoes]);
+
+    -- Detecção de ausência: anti-join por membro e competência. Fora do
+    -- esquema de partição (não alinhado): alinhado, cada membro custaria uma
+    -- busca por partição anual, e o custo cresceria com os anos guardados.
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Dizimo_MembroCompetencia'
+                     AND object_id = OBJECT_ID(N'[{schema}].[DizimoLancamentos]'))
+        CREATE INDEX IX_Dizimo_MembroCompetencia
+            ON [{schema}].[DizimoLancamentos]([membro_id], [competencia]) ON [PRIMARY];
+    ELSE IF EXISTS (SELECT 1 FROM sys.indexes i
+                      JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+                     WHERE i.name = N'IX_Dizimo_MembroCompetencia'
+                       AND i.object_id = OBJECT_ID(N'[{schema}].[DizimoLancamentos]'))
+        CREATE INDEX IX_Dizimo_MembroCompetencia
+            ON [{schema}].[DizimoLancamentos]([membro_id], [competencia])
+            WITH (DROP_EXISTING = ON) ON [PRIMARY];
+
+    -- Membros ativos com as colunas que detectar_ausentes devolve (e a do
+    -- filtro, senão o otimizador ainda busca a linha na tabela); um índice
+    -- anterior, sem data_entrada, é recriado com as colunas atuais
+    IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_Membros_Ativos'
+                     AND object_id = OBJECT_ID(N'[{schema}].[Membros]'))
+        CREATE INDEX IX_Membros_Ativos
+            ON [{schema}].[Membros]([id])
+            INCLUDE ([matricula], [nome], [endereco], [telefone], [email], [data_entrada], [data_desligamento])
+            WHERE [data_desligamento] IS NULL;
+    ELSE IF NOT EXISTS (SELECT 1 FROM sys.indexes i
+                          JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+                         WHERE i.name = N'IX_Membros_Ativos'
+                           AND i.object_id = OBJECT_ID(N'[{schema}].[Membros]')
+                           AND COL_NAME(ic.object_id, ic.column_id) = N'data_entrada')
+        CREATE INDEX IX_Membros_Ativos
+            ON [{schema}].[Membros]([id])
+            INCLUDE ([matricula], [nome], [endereco], [telefone], [email], [data_entrada], [data_desligamento])
+            WHERE [data_desligamento] IS NULL
+            WITH (DROP_EXISTING = ON);
+
+    -- Períodos fechados e o snapshot imutável do painel de cada ano fechado
+    IF OBJECT_ID(N'[{schema}].[PeriodosFechados]', N'U') IS NULL
+        CREATE TABLE [{schema}].[PeriodosFechados](
+            [ano]               INT NOT NULL PRIMARY KEY,
+            [total_dizimo]      DECIMAL(12,2) NOT NULL,
+            [total_oferta]      DECIMAL(12,2) NOT NULL,
+            [fechado_em]        DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        );
+
+    IF OBJECT_ID(N'[{schema}].[PainelSnapshot]', N'U') IS NULL
+        CREATE TABLE [{schema}].[PainelSnapshot](
+            [ano]               INT NOT NULL,
+            [membro_id]         INT NOT NULL,
+            [nome]              NVARCHAR(255) NULL,
+            [mes]               INT NOT NULL,
+            [total_dizimo]      DECIMAL(12,2) NOT NULL,
+            [total_oferta]      DECIMAL(12,2) NOT NULL,
+            CONSTRAINT PK_PainelSnapshot PRIMARY KEY ([ano], [membro_id], [mes])
+        );
+
+    -- Bloqueia INSERT/UPDATE/DELETE em lançamentos de anos fechados
+    IF OBJECT_ID(N'[{schema}].[TR_Dizimo_PeriodoFechado]', N'TR') IS NULL
+        EXEC(N'
+        CREATE TRIGGER [{schema}].[TR_Dizimo_PeriodoFechado]
+            ON [{schema}].[DizimoLancamentos]
+            AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            IF EXISTS (SELECT 1 FROM inserted i JOIN [{schema}].[PeriodosFechados] p ON p.ano = i.ano)
+               OR EXISTS (SELECT 1 FROM deleted d JOIN [{schema}].[PeriodosFechados] p ON p.ano = d.ano)
+                THROW 50001, N''Período fechado: os lançamentos deste ano não podem ser alterados.'', 1;
+        END');
+    """.format(schema=tenant_schema(tenant), particao=particao)
+    ok = execute_query(ddl, tenant=tenant)  # se já existir, não faz nada
+    if ok is True:
+        manter_particoes_financeiras(tenant=tenant)
+        _SCHEMAS_VERIFICADOS.add(tenant)
+
+
+# -----------------------------------------------------------------------------
+# Particionamento de DizimoLancamentos por ano
+# -----------------------------------------------------------------------------
+# A função PF_DizimoAno (RANGE RIGHT) tem uma fronteira por ano a partir de
+# ANO_INICIAL_PARTICOES; manter_particoes_financeiras cria a partição do ano
+# seguinte antes dele começar (split de partição vazia = só metadados).
+# Onde o servidor não permitir particionamento, a tabela é criada sem ele, com
+# o mesmo índice agrupado (ano, mes, id) e os mesmos índices de cobertura:
+# as consultas e os planos por ano são equivalentes, o que permite testar
+# localmente em qualquer SQL Server (Express/LocalDB/contêiner).
+#
+# Tabelas criadas antes do particionamento (PK agrupada em id) continuam como
+# estão até rodar particionar_lancamentos (python cli.py particionar-lancamentos),
+# que reconstrói o índice agrupado no esquema de partição. A tabela inteira é
+# reescrita: rodar fora do horário de uso.
+
+ANO_INICIAL_PARTICOES = 2015
+
+
+def _criar_particionamento(tenant=None):
+    """Cria função/esquema de partição (se possível). Retorna True se existirem."""
+    ddl = """
+    IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = N'PF_DizimoAno')
+        CREATE PARTITION FUNCTION PF_DizimoAno (INT) AS RANGE RIGHT FOR VALUES ({ano});
+    IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = N'PS_DizimoAno')
+        CREATE PARTITION SCHEME PS_DizimoAno AS PARTITION PF_DizimoAno ALL TO ([PRIMARY]);
+    """.format(ano=ANO_INICIAL_PARTICOES)
+    return execute_query(ddl, tenant=tenant) is True
+
+
+def particionar_lancamentos(tenant=None):
+    """
+    Migra uma DizimoLancamentos antiga (PK agrupada em id) para o índice
+    agrupado (ano, mes, id) em PS_DizimoAno, numa única transação. Se a tabela
+    já estiver particionada, não faz nada. Retorna True ou a mensagem de erro.
+    """
+    tenant = tenant or tenant_atual()
+    ensure_finance_schema(tenant)
+    tabela = "[{schema}].[DizimoLancamentos]".format(schema=tenant_schema(tenant))
+    # Cada passo em EXEC: ano/mes são recriados no meio do lote
+    sql = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @tabela NVARCHAR(300) = N'{tabela}', @pk SYSNAME;
+        IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = N'PS_DizimoAno')
+            THROW 50004, N'O servidor não tem o esquema de partição PS_DizimoAno.', 1;
+        IF EXISTS (SELECT 1 FROM sys.indexes i
+                     JOIN sys.partition_schemes ps ON ps.data_space_id = i.data_space_id
+                    WHERE i.object_id = OBJECT_ID(@tabela) AND i.index_id = 1)
+            RETURN;
+
+        BEGIN TRANSACTION;
+        -- índices que usam ano/mes ou o id; são recriados alinhados
+        DROP INDEX IF EXISTS UX_Dizimo_MembroCompetencia ON {tabela};
+        DROP INDEX IF EXISTS IX_Dizimo_Painel ON {tabela};
+        DROP INDEX IF EXISTS IX_Dizimo_Lista ON {tabela};
+        DROP INDEX IF EXISTS IX_Dizimo_Id ON {tabela};
+
+        -- na chave agrupada, ano/mes precisam ser NOT NULL
+        IF COLUMNPROPERTY(OBJECT_ID(@tabela), 'ano', 'AllowsNull') = 1
+        BEGIN
+            EXEC(N'ALTER TABLE {tabela} DROP COLUMN [ano], [mes]');
+            EXEC(N'ALTER TABLE {tabela} ADD [ano] AS (YEAR([competencia])) PERSISTED NOT NULL,
+                                           [mes] AS (MONTH([competencia])) PERSISTED NOT NULL');
+        END
+
+        SELECT @pk = name FROM sys.key_constraints WHERE parent_object_id = OBJECT_ID(@tabela) AND type = 'PK';
+        IF @pk IS NOT NULL
+            EXEC(N'ALTER TABLE {tabela} DROP CONSTRAINT ' + QUOTENAME(@pk));
+        EXEC(N'ALTER TABLE {tabela} ADD CONSTRAINT PK_DizimoLancamentos
+                 PRIMARY KEY CLUSTERED ([ano], [mes], [id]) ON PS_DizimoAno([ano])');
+        EXEC(N'CREATE UNIQUE INDEX UX_Dizimo_MembroCompetencia ON {tabela}([membro_id], [ano], [mes])');
+        EXEC(N'CREATE INDEX IX_Dizimo_Id ON {tabela}([id])');
+        COMMIT TRANSACTION;
+    """.format(tabela=tabela)
+    conx = get_connection(tenant)
+    if not conx:
+        return False
+    try:
+        conx.timeout = 0   # reescreve a tabela inteira: sem limite de tempo
+        conx.cursor().execute(sql)
+        conx.commit()
+        invalidar_cache(tenant)
+    except Exception as e:
+        conx.rollback()
+        return str(e)
+    finally:
+        conx.close()
+    # recria IX_Dizimo_Painel (e confere os demais índices) no novo layout
+    _SCHEMAS_VERIFICADOS.discard(tenant)
+    ensure_finance_schema(tenant)
+    return True
+
+
+def manter_particoes_financeiras(anos_a_frente=1, tenant=None):
+    """
+    Garante uma partição para cada ano até o ano corrente + anos_a_frente.
+    Sem particionamento no banco, não faz nada.
+    """
+    sql = """
+        SET NOCOUNT ON;
+        DECLARE @ate INT = ?;
+        IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = N'PF_DizimoAno')
+        BEGIN
+            DECLARE @ano INT = (
+                SELECT MAX(CAST(v.value AS INT))
+                  FROM sys.partition_range_values v
+                  JOIN sys.partition_functions f ON f.function_id = v.function_id
+                 WHERE f.name = N'PF_DizimoAno'
+            );
+            WHILE @ano < @ate
+            BEGIN
+                SET @ano = @ano + 1;
+                ALTER PARTITION SCHEME PS_DizimoAno NEXT USED [PRIMARY];
+                ALTER PARTITION FUNCTION PF_DizimoAno() SPLIT RANGE (@ano);
+            END
+        END
+    """
+    return execute_query(sql, (datetime.date.today().year + int(anos_a_frente),), tenant=tenant)
+
+
+# -----------------------------------------------------------------------------
+# Fechamento de período (anos fechados servidos por snapshot)
+# -----------------------------------------------------------------------------
+
+QUERY_PAINEL_ANO = """
+    SELECT l.membro_id, m.nome,
+           l.ano, l.mes,
+           SUM(l.valor_dizimo)   AS total_dizimo,
+           SUM(l.valor_oferta)   AS total_oferta
+      FROM DizimoLancamentos l
+      JOIN Membros m ON m.id = l.membro_id
+     WHERE l.ano = ?
+     GROUP BY l.membro_id, m.nome, l.ano, l.mes
+"""
+
+
+def anos_fechados(tenant=None, primario=False):
+    """
+    Conjunto dos anos já fechados da igreja. Com primario=True lê direto do
+    primário, sem cache nem réplica: é o que decide se uma gravação é aceita,
+    inclusive quando o ano acabou de ser fechado por outro processo.
+    """
+    query = "SELECT ano FROM PeriodosFechados"
+    df = read_records(query, tenant=tenant, primario=True) if primario else read_cached(query, tenant=tenant)
+    return set(int(a) for a in df["ano"]) if not df.empty else set()
+
+
+def fechar_periodo(ano, tenant=None):
+    """
+    Fecha o ano: grava o painel (totais por membro/mês) em PainelSnapshot e os
+    totais em PeriodosFechados numa única transação. A partir daí o gatilho
+    TR_Dizimo_PeriodoFechado bloqueia qualquer escrita no ano.
+    """
+    sql = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @ano INT = ?;
+        BEGIN TRANSACTION;
+        IF EXISTS (SELECT 1 FROM PeriodosFechados WITH (UPDLOCK, HOLDLOCK) WHERE ano = @ano)
+            THROW 50002, N'Período já fechado.', 1;
+
+        INSERT INTO PainelSnapshot (ano, membro_id, nome, mes, total_dizimo, total_oferta)
+        SELECT l.ano, l.membro_id, m.nome, l.mes, SUM(l.valor_dizimo), SUM(l.valor_oferta)
+          FROM DizimoLancamentos l WITH (UPDLOCK, HOLDLOCK)
+          JOIN Membros m ON m.id = l.membro_id
+         WHERE l.ano = @ano
+         GROUP BY l.ano, l.membro_id, m.nome, l.mes;
+
+        INSERT INTO PeriodosFechados (ano, total_dizimo, total_oferta)
+        SELECT @ano, COALESCE(SUM(total_dizimo), 0), COALESCE(SUM(total_oferta), 0)
+          FROM PainelSnapshot
+         WHERE ano = @ano;
+        COMMIT TRANSACTION;
+    """
+    return execute_query(sql, (int(ano),), tenant=tenant)
+
+
+def _snapshot_path(tenant, ano, nome="painel"):
+    base = pathlib.Path(config("snapshot_dir", ".snapshots"))
+    return base / tenant / f"{nome}_{int(ano)}.parquet"
+
+
+def painel_snapshot(ano, tenant=None):
+    """
+    Painel de um ano fechado: lido do arquivo colunar local (Parquet) e, se
+    ainda não existir, da tabela PainelSnapshot, gravando o arquivo.
+    """
+    tenant = tenant or tenant_atual()
+    caminho = _snapshot_path(tenant, ano)
+    try:
+        return pd.read_parquet(caminho)
+    except (OSError, ImportError):
+        pass
+    df = read_records(
+        "SELECT membro_id, nome, ano, mes, total_dizimo, total_oferta FROM PainelSnapshot WHERE ano = ?",
+        params=(int(ano),), arrow=True, tenant=tenant
+    )
+    if not df.empty:
+        try:
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(caminho, index=False)
+        except (OSError, ImportError):
+            pass  # sem pyarrow ou sem disco: segue lendo da tabela de snapshot
+    return df
+
+
+def carregar_painel(ano, tenant=None):
+    """Totais por membro/mês do ano: snapshot se o ano estiver fechado, senão tabela viva."""
+    if int(ano) in anos_fechados(tenant):
+        return painel_snapshot(ano, tenant)
+    return read_records(QUERY_PAINEL_ANO, params=(int(ano),), arrow=True, tenant=tenant)
+
+
+# -----------------------------------------------------------------------------
+# Conciliação financeira (totais com subtotais numa única consulta)
+# -----------------------------------------------------------------------------
+# GROUPING SETS calcula no servidor, numa ida ao banco, todos os níveis do
+# relatório: mês x forma de pagamento, subtotal do mês, total por forma, por
+# situação do pagamento, situação x mês e o total geral. As colunas g_* (1 =
+# nível agregado) dizem a que nível cada linha pertence.
+#
+# A situação compara data_pagamento com o mês de competência. Só usa ano/mes
+# (e não competencia), então a consulta fica coberta tanto pelo índice
+# agrupado (ano, mes, id) quanto por IX_Dizimo_Lista nas tabelas antigas.
+
+QUERY_CONCILIACAO = """
+    SELECT l.mes, f.forma_pagamento, s.situacao,
+           COUNT(*)                  AS lancamentos,
+           COUNT(DISTINCT l.membro_id) AS membros,
+           SUM(l.valor_dizimo)       AS total_dizimo,
+           SUM(l.valor_oferta)       AS total_oferta,
+           SUM(l.valor_dizimo + l.valor_oferta) AS total,
+           GROUPING(l.mes)             AS g_mes,
+           GROUPING(f.forma_pagamento) AS g_forma,
+           GROUPING(s.situacao)        AS g_situacao
+      FROM DizimoLancamentos l
+     CROSS APPLY (SELECT COALESCE(NULLIF(LTRIM(RTRIM(l.forma_pagamento)), ''), N'Não informada') AS forma_pagamento) f
+     CROSS APPLY (SELECT CASE
+                           WHEN l.data_pagamento < DATEFROMPARTS(l.ano, l.mes, 1) THEN N'Antecipado'
+                           WHEN l.data_pagamento > EOMONTH(DATEFROMPARTS(l.ano, l.mes, 1)) THEN N'Em atraso'
+                           ELSE N'No mês'
+                         END AS situacao) s
+     WHERE l.ano = ?
+     GROUP BY GROUPING SETS (
+           (l.mes, f.forma_pagamento),
+           (l.mes),
+           (f.forma_pagamento),
+           (l.mes, s.situacao),
+           (s.situacao),
+           ()
+     )
+"""
+
+
+def carregar_conciliacao(ano, tenant=None):
+    """
+    Linhas da conciliação do ano (ver QUERY_CONCILIACAO). Anos abertos ficam
+    no cache da igreja até a próxima escrita; anos fechados não mudam mais e
+    são guardados em arquivo local (Parquet), como o painel.
+    """
+    tenant = tenant or tenant_atual()
+    ano = int(ano)
+    if ano not in anos_fechados(tenant):
+        return read_cached(QUERY_CONCILIACAO, (ano,), tenant=tenant)
+    caminho = _snapshot_path(tenant, ano, "conciliacao")
+    try:
+        return pd.read_parquet(caminho)
+    except (OSError, ImportError):
+        pass
+    df = read_cached(QUERY_CONCILIACAO, (ano,), tenant=tenant)
+    if not df.empty:
+        try:
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            df.to_parquet(caminho, index=False)
+        except (OSError, ImportError):
+            pass
+    return df
+
+
+# -----------------------------------------------------------------------------
+# Detecção de ausência
+# -----------------------------------------------------------------------------
+
+def inicio_janela_ausencia(meses, referencia=None):
+    """1º dia do mês 'meses' meses antes do mês de referência (padrão: hoje)."""
+    referencia = referencia or datetime.date.today()
+    total = referencia.year * 12 + (referencia.month - 1) - int(meses)
+    return datetime.date(total // 12, total % 12 + 1, 1)
+
+
+def detectar_ausentes(meses, referencia=None, tenant=None):
+    """
+    Membros ativos (sem data_desligamento) sem nenhuma contribuição com
+    competência nos últimos 'meses' meses completos nem no mês corrente.
+    Quem entrou dentro da janela ainda não teve como contribuir nela e não
+    entra na lista.
+
+    Um único anti-join (NOT EXISTS) apoiado em IX_Dizimo_MembroCompetencia
+    (membro_id, competencia) e no índice filtrado IX_Membros_Ativos, que cobre
+    as colunas devolvidas: cada membro custa uma busca no índice, não importa
+    quantos anos de lançamentos.
+    """
+    ensure_finance_schema(tenant)
+    query = """
+        SELECT m.id, m.matricula, m.nome, m.endereco, m.telefone, m.email,
+               u.ultima_competencia
+          FROM Membros m
+          OUTER APPLY (SELECT MAX(l.competencia) AS ultima_competencia
+                         FROM DizimoLancamentos l
+                        WHERE l.membro_id = m.id) u
+         WHERE m.data_desligamento IS NULL
+           AND (m.data_entrada IS NULL OR m.data_entrada < ?)
+           AND NOT EXISTS (SELECT 1
+                             FROM DizimoLancamentos l
+                            WHERE l.membro_id = m.id
+                              AND l.competencia >= ?)
+         ORDER BY m.nome
+    """
+    inicio = inicio_janela_ausencia(meses, referencia)
+    return read_records(query, params=(inicio, inicio), tenant=tenant)
+
+
+# -----------------------------------------------------------------------------
+# Aquecimento na subida do processo
+# -----------------------------------------------------------------------------
+# Depois de um cold start (instância acordando), a primeira sessão pagaria a
+# abertura das conexões e as primeiras leituras. iniciar_aquecimento() roda
+# aquecer() uma única vez por processo, numa thread em segundo plano: abre o
+# pool de cada igreja e deixa no cache o cadastro da igreja e a listagem dos
+# membros (sem as fotos). Cada consulta vai com o mesmo arrow= usado pelas
+# páginas, senão a chave do cache não bate.
+
+CONSULTAS_AQUECIMENTO = (
+    (QUERY_IGREJA, False),   # traz o logotipo (binário)
+    (QUERY_MEMBROS, True),
+    (QUERY_DIRETORIO_MEMBROS, True),
+)
+
+TEMPOS_INICIO = {}   # etapa -> segundos; exibido na Manutenção
+_AQUECIMENTO_LOCK = threading.Lock()
+_aquecimento = None
+
+
+def registrar_tempo(etapa, segundos):
+    TEMPOS_INICIO[etapa] = round(float(segundos), 3)
+
+
+def aquecer(alvos=None):
+    """Abre o pool e pré-carrega as leituras compartilhadas de cada igreja."""
+    try:
+        alvos = list(alvos or tenants())
+    except KeyError as e:
+        logger.warning("Aquecimento ignorado: configuração incompleta (%s).", e)
+        return
+    for tenant in alvos:
+        inicio = time.perf_counter()
+        try:
+            conectar(tenant).close()   # a conexão volta ao pool da igreja
+        except Exception as e:
+            logger.warning("Aquecimento da igreja %s falhou: %s", tenant, e)
+            continue
+        for query, arrow in CONSULTAS_AQUECIMENTO:
+            read_cached(query, tenant=tenant, arrow=arrow)
+        registrar_tempo(f"aquecimento [{tenant}]", time.perf_counter() - inicio)
+
+
+def iniciar_aquecimento():
+    """Dispara aquecer() em segundo plano, só na primeira chamada do processo."""
+    global _aquecimento
+    with _AQUECIMENTO_LOCK:
+        if _aquecimento is None:
+            _aquecimento = threading.Thread(target=aquecer, name="aquecimento", daemon=True)
+            _aquecimento.start()
+    return _aquecimento
@@ -1,43 +1,44 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
-import time
 import datetime
-import pyodbc
-from io import BytesIO
+import pathlib
+import time
 
-# Bibliotecas necessárias para geração de documentos
-from fpdf import FPDF
-from docx import Document
+import dados
+from dados import (
+    ACOES_LOTE_MEMBROS, COLUNAS_MEMBROS, QUERY_DIRETORIO_MEMBROS, QUERY_IGREJA, QUERY_MEMBROS,
+    anos_fechados, carregar_conciliacao, carregar_foto_membro, carregar_fotos_membros,
+    carregar_membros_sem_foto, carregar_painel, circuito,
+    detectar_ausentes, ensure_finance_schema, estado_replica, execute_lote, execute_query, fechar_periodo,
+    manter_particoes_financeiras, read_cached, read_records, read_records_lote,
+    tenant_atual, tenant_config, tenants,
+)
+from duplicados import detectar_duplicados, mesclar_membros
+from imagens import (
+    FOTO_MAX_LADO, LOGO_MAX_LADO, exportar_fotos_zip, preparar_imagem, reprocessar_imagens,
+    restaurar_fotos_zip,
+)
+from relatorios import (
+    BLOCOS_PAINEL, carta_transferencia_docx, certificado_batismo_pdf, colunas_valores_conciliacao,
+    conciliacao_excel_bytes, excel_bytes, fmt_brl, fmt_date_br, formatar_br, gerar_cartas_ausencia_pdf,
+    montar_conciliacao, montar_painel, painel_excel_bytes,
+)
 
 # -----------------------------------------------------------------------------
-# Configuração Geral do Streamlit
+# Helpers de exibição
 # -----------------------------------------------------------------------------
-st.set_page_config(page_title="Demonstração Local", layout="wide")
 
-# -----------------------------------------------------------------------------
-# Helpers de data (somente EXIBIÇÃO em PT-BR)
-# -----------------------------------------------------------------------------
-def fmt_date_br(d):
-    """Converte uma data para 'DD/MM/YYYY' somente para exibição."""
-    if d is None or d == "":
-        return ""
-    if isinstance(d, (datetime.date, datetime.datetime)):
-        return d.strftime("%d/%m/%Y")
-    # tenta normalizar com pandas
-    ts = pd.to_datetime(d, errors="coerce")
-    if pd.isna(ts):
-        return ""
-    return ts.strftime("%d/%m/%Y")
-
-def df_to_br_display(df, date_cols):
-    """Retorna uma cópia do DF com colunas de data formatadas como 'DD/MM/YYYY'."""
-    df2 = df.copy()
+def br_column_config(date_cols=(), base=None):
+    """
+    column_config de exibição para st.dataframe/st.data_editor: as datas são
+    mostradas como DD/MM/YYYY sem copiar nem converter o DataFrame.
+    """
+    config = dict(base or {})
     for c in date_cols:
-        if c in df2.columns:
-            s = pd.to_datetime(df2[c], errors="coerce")
-            s = s.dt.strftime("%d/%m/%Y")
-            df2[c] = s.fillna("")
-    return df2
+        config.setdefault(c, st.column_config.DateColumn(format="DD/MM/YYYY"))
+    return config
+
 
 def safe_date(v, default=None):
     if isinstance(v, datetime.datetime):
@@ -46,76 +47,36 @@ def safe_date(v, default=None):
         return v
     return default or datetime.date.today()
 
-# -----------------------------------------------------------------------------
-# Conexão com banco de dados
-# -----------------------------------------------------------------------------
 
-def get_connection():
-    server = st.secrets["server"]
-    database = st.secrets["database"]
-    username = st.secrets["username"]
-    password = st.secrets["password"]
-    driver = '{ODBC Driver 17 for SQL Server}'
-    try:
-        conx = pyodbc.connect(
-            'Driver='+ driver + ';Server='+ server + ';Database=' + database + ';Uid=' + username + ';Pwd={' + password + '}'
-        )
-        return conx
-    except Exception as e:
-        st.error(f"Erro ao conectar ao banco de dados: {e}")
-        return None
+def exibir_fotos_membros(key):
+    """Fotos dos membros, lidas do banco só quando o usuário pede."""
+    if st.checkbox("Mostrar fotos dos membros", key=key):
+        for row in carregar_fotos_membros().itertuples():
+            st.image(row.foto, caption=row.nome, width=100)
 
 
-def read_records(query, params=None):
-    """
-    Executa um SELECT e retorna um DataFrame.
-    """
-    conx = get_connection()
-    if not conx:
-        return pd.DataFrame()
-    try:
-        df = pd.read_sql(query, conx, params=params)
-        return df
-    except Exception as e:
-        st.error(f"Erro ao ler registros: {e}")
-        return pd.DataFrame()
-    finally:
-        conx.close()
-
+def ler_upload_imagem(uploaded, max_lado=FOTO_MAX_LADO):
+    """Bytes de um st.file_uploader já processados por preparar_imagem (None se vazio)."""
+    if uploaded is None:
+        return None
+    return preparar_imagem(uploaded.getvalue(), max_lado)
 
 # -----------------------------------------------------------------------------
-# Executa um comando SQL (INSERT, UPDATE ou DELETE) e confirma (commit)
+# Ligação da camada de dados com o Streamlit
 # -----------------------------------------------------------------------------
 
-def execute_query(query, params=None):
-    """
-    Executa um comando SQL (INSERT, UPDATE ou DELETE) e confirma (commit).
-    """
-    conx = get_connection()
-    if not conx:
-        return False
-    try:
-        cursor = conx.cursor()
-        if params:
-            cursor.execute(query, params)
-        else:
-            cursor.execute(query)
-        conx.commit()
-        if cursor.rowcount == 0:
-            return "Nenhuma linha foi afetada."
-        return True
-
-    except Exception as e:
-        error_message = str(e)
-        # Se achar "2627" ou "duplicate key", é chave duplicada
-        if "2627" in error_message or "duplicate key" in error_message:
-            return "Entrada duplicada."  # Mensagem genérica
-        else:
-            return error_message
-    finally:
-        conx.close()
+def configurar_dados():
+    """Repassa st.secrets à camada de dados e liga a igreja da sessão e os erros à tela."""
+    dados.configurar(st.secrets.to_dict())
+    dados.origem_tenant = lambda: st.session_state.get("tenant")
+    dados.reportar_erro = st.error
+    dados.origem_sessao = sessao_streamlit
 
 
+def sessao_streamlit():
+    """session_state da sessão em execução (None fora dela, ex.: thread de aquecimento)."""
+    return st.session_state if get_script_run_ctx(suppress_warning=True) is not None else None
+
 # -----------------------------------------------------------------------------
 # SEÇÃO DE LOGIN
 # -----------------------------------------------------------------------------
@@ -126,20 +87,35 @@ CREDENTIALS = {
     "adm-secretaria": "sec123"
 }
 
-if "logged_in" not in st.session_state:
-    st.session_state["logged_in"] = False
-if "user_role" not in st.session_state:
-    st.session_state["user_role"] = None
+
+def credenciais_igreja(tenant, todas):
+    """
+    Usuários e senhas da igreja. CREDENTIALS só vale com uma única igreja
+    configurada; com várias, cada uma precisa da sua seção 'usuarios'
+    (senão uma senha padrão daria acesso a todas). None se não houver.
+    """
+    if "usuarios" in todas[tenant]:
+        return todas[tenant]["usuarios"]
+    return CREDENTIALS if len(todas) == 1 else None
 
 
 def login_screen():
     st.title("Login do Sistema")
+    todas = tenants()
+    if len(todas) > 1:
+        tenant = st.selectbox("Igreja", options=list(todas), format_func=lambda t: todas[t].get("nome", t))
+    else:
+        tenant = next(iter(todas))
     user = st.text_input("Usuário")
     password = st.text_input("Senha", type="password")
     if st.button("Entrar"):
-        if user in CREDENTIALS and password == CREDENTIALS[user]:
+        credenciais = credenciais_igreja(tenant, todas)
+        if credenciais is None:
+            st.error("Esta igreja não tem usuários configurados ([tenants.<igreja>.usuarios]).")
+        elif user in credenciais and password == credenciais[user]:
             st.session_state["logged_in"] = True
             st.session_state["user_role"] = user
+            st.session_state["tenant"] = tenant
             st.rerun()
         else:
             st.error("Usuário ou senha inválidos. Tente novamente.")
@@ -149,6 +125,7 @@ def logout_button():
     if st.sidebar.button("Sair"):
         st.session_state["logged_in"] = False
         st.session_state["user_role"] = None
+        st.session_state["tenant"] = None
         st.rerun()
 
 
@@ -156,27 +133,30 @@ def logout_button():
 # INICIALIZAÇÃO DE DADOS (session_state)
 # -----------------------------------------------------------------------------
 
-# 1) Igreja
-if "igreja_data" not in st.session_state:
-    st.session_state["igreja_data"] = {
-        "logotipo": None,
-        "cnpj": "",
-        "data_abertura": None,
-        "endereco": "",
-        "pastor_nome": "",
-        "pastor_entrada": None,
-        "pastor_saida": None
-    }
-
-# 2) Membros (ajustado para novo esquema: PK 'id' e nova coluna 'matricula')
-if "membros_data" not in st.session_state:
-    st.session_state["membros_data"] = pd.DataFrame(columns=[
-        "id", "matricula", "nome", "foto", "ministerio", "endereco",
-        "telefone", "email", "sexo", "data_nascimento", "estado_civil", "nome_conjuge",
-        "disciplina_data_ini", "disciplina_data_fim", "data_entrada",
-        "tipo_entrada", "data_desligamento", "motivo_desligamento",
-        "mes_aniversario"
-    ])
+def init_session_state():
+    # Login
+    if "logged_in" not in st.session_state:
+        st.session_state["logged_in"] = False
+    if "user_role" not in st.session_state:
+        st.session_state["user_role"] = None
+    if "tenant" not in st.session_state:
+        st.session_state["tenant"] = None
+
+    # 1) Igreja
+    if "igreja_data" not in st.session_state:
+        st.session_state["igreja_data"] = {
+            "logotipo": None,
+            "cnpj": "",
+            "data_abertura": None,
+            "endereco": "",
+            "pastor_nome": "",
+            "pastor_entrada": None,
+            "pastor_saida": None
+        }
+
+    # 2) Membros (ajustado para novo esquema: PK 'id' e nova coluna 'matricula')
+    if "membros_data" not in st.session_state:
+        st.session_state["membros_data"] = pd.DataFrame(columns=COLUNAS_MEMBROS)
 
 
 # -----------------------------------------------------------------------------
@@ -187,7 +167,7 @@ def page_igreja():
     st.header("Cadastro de Igreja")
 
     # Verifica se já existe um cadastro na tabela Igreja
-    df_igreja = read_records("SELECT * FROM Igreja")
+    df_igreja = read_cached(QUERY_IGREJA)
     
     if st.session_state["user_role"] == "adm-secretaria":
         st.subheader("Igreja Cadastrada")
@@ -220,9 +200,12 @@ def page_igreja():
             with st.form("form_editar_igreja"):
                 uploaded_logo = st.file_uploader("Selecione um novo logotipo da Igreja (opcional)", 
                                                    type=["png", "jpg", "jpeg"])
-                if uploaded_logo is not None:
-                    logotipo_bin = uploaded_logo.read()
-                else:
+                try:
+                    logotipo_bin = ler_upload_imagem(uploaded_logo, LOGO_MAX_LADO)
+                    erro_logo = None
+                except ValueError as e:
+                    logotipo_bin, erro_logo = None, str(e)
+                if logotipo_bin is None:
                     logotipo_bin = igreja["logotipo"]
                 
                 cnpj_val = st.text_input("CNPJ da Igreja*", value=igreja["cnpj"], disabled=True)
@@ -249,7 +232,9 @@ def page_igreja():
                 
                 submit_edit = st.form_submit_button("Atualizar Dados")
                 
-                if submit_edit:
+                if submit_edit and erro_logo:
+                    st.error(f"Logotipo: {erro_logo}")
+                elif submit_edit:
                     update_sql = """
                         UPDATE Igreja
                         SET logotipo = ?,
@@ -314,7 +299,11 @@ def page_igreja():
         with st.form("form_nova_igreja"):
             uploaded_logo = st.file_uploader("Selecione o logotipo da Igreja (opcional)", 
                                              type=["png", "jpg", "jpeg"])
-            logotipo_bin = uploaded_logo.read() if uploaded_logo is not None else None
+            try:
+                logotipo_bin = ler_upload_imagem(uploaded_logo, LOGO_MAX_LADO)
+                erro_logo = None
+            except ValueError as e:
+                logotipo_bin, erro_logo = None, str(e)
 
             cnpj_val = st.text_input("CNPJ da Igreja*")
             try:
@@ -351,6 +340,8 @@ def page_igreja():
                     erros.append("Data de Entrada do Pastor")
                 if not pastor_saida_val:
                     erros.append("Data de Saída do Pastor")
+                if erro_logo:
+                    erros.append(f"Logotipo ({erro_logo})")
                 if erros:
                     texto_erros = "### Atenção!\n\nOs seguintes campos obrigatórios não foram preenchidos:\n\n"
                     for campo in erros:
@@ -391,7 +382,7 @@ def page_igreja():
 
 def page_membros():
     st.header("Cadastro de Membros")
-    df_membros = read_records("SELECT * FROM Membros")
+    df_membros = read_cached(QUERY_MEMBROS, arrow=True)
 
     # Para secretaria: apenas visualização
     if st.session_state["user_role"] == "adm-secretaria":
@@ -400,12 +391,10 @@ def page_membros():
         else:
             st.subheader("Listagem de Membros")
             cols_dt_m = ["data_nascimento","disciplina_data_ini","disciplina_data_fim","data_entrada","data_desligamento"]
-            df_membros_br = df_to_br_display(df_membros, cols_dt_m)
-            st.dataframe(df_membros_br, use_container_width=True)
+            st.dataframe(df_membros, use_container_width=True,
+                         column_config=br_column_config(cols_dt_m))
             st.subheader("Fotos dos Membros")
-            for _, row in df_membros.iterrows():
-                if row.get("foto") is not None:
-                    st.image(row["foto"], caption=row['nome'], width=100)
+            exibir_fotos_membros("fotos_secretaria")
         return
 
     if df_membros.empty:
@@ -421,7 +410,11 @@ def page_membros():
             matricula_input = st.text_input("Matrícula*")
             nome = st.text_input("Nome completo*")
             uploaded_foto = st.file_uploader("Foto do Membro (opcional)", type=["png", "jpg", "jpeg"])
-            foto_bytes = uploaded_foto.read() if uploaded_foto is not None else None
+            try:
+                foto_bytes = ler_upload_imagem(uploaded_foto, FOTO_MAX_LADO)
+                erro_foto = None
+            except ValueError as e:
+                foto_bytes, erro_foto = None, str(e)
             ministerio = st.text_input("Ministério (opcional)")
             endereco = st.text_input("Endereço (opcional)")
             telefone = st.text_input("Telefone (opcional) (DDXXXXXXXXX)")
@@ -478,6 +471,8 @@ def page_membros():
                     erros.append("Data de Nascimento")
                 if sexo == "Selecione...":
                     erros.append("Sexo")
+                if erro_foto:
+                    erros.append(f"Foto ({erro_foto})")
 
                 if erros:
                     st.error("Preencha corretamente os campos obrigatórios: " + ", ".join(erros))
@@ -555,8 +550,9 @@ def page_membros():
             # Mostra a foto atual (se existir)
             row_atual = membros_df.loc[membros_df["id"] == membro_sel].iloc[0]
             st.write(f"**Membro:** {row_atual['nome']}")
-            if row_atual.get("foto") is not None:
-                st.image(row_atual["foto"], caption="Foto atual", width=150)
+            foto_atual = carregar_foto_membro(membro_sel)
+            if foto_atual is not None:
+                st.image(foto_atual, caption="Foto atual", width=150)
             else:
                 st.caption("Sem foto cadastrada.")
 
@@ -571,16 +567,20 @@ def page_membros():
                     if nova_foto is None:
                         st.warning("Envie uma imagem antes de salvar.")
                     else:
-                        foto_bytes_nova = nova_foto.read()
-                        ok = execute_query(
-                            "UPDATE Membros SET foto = ? WHERE id = ?",
-                            (foto_bytes_nova, int(membro_sel))
-                        )
-                        if ok is True:
-                            st.success("Foto atualizada com sucesso!")
-                            st.rerun()
+                        try:
+                            foto_bytes_nova = ler_upload_imagem(nova_foto, FOTO_MAX_LADO)
+                        except ValueError as e:
+                            st.error(f"Falha ao atualizar foto: {e}")
                         else:
-                            st.error(f"Falha ao atualizar foto: {ok}")
+                            ok = execute_query(
+                                "UPDATE Membros SET foto = ? WHERE id = ?",
+                                (foto_bytes_nova, int(membro_sel))
+                            )
+                            if ok is True:
+                                st.success("Foto atualizada com sucesso!")
+                                st.rerun()
+                            else:
+                                st.error(f"Falha ao atualizar foto: {ok}")
 
             with col_f2:
                 if st.button("Remover foto atual"):
@@ -606,7 +606,9 @@ def page_membros():
                     tipo_entrada = ?, data_desligamento = ?, motivo_desligamento = ?, mes_aniversario = ?
                 WHERE id = ?
             """
-            update_params = (
+            # a grade vem do caminho Arrow: célula vazia é pd.NA, que o
+            # pyodbc não aceita como parâmetro
+            update_params = tuple(None if pd.isna(v) else v for v in (
                 row.get("matricula"),
                 row.get("nome"),
                 row.get("ministerio"),
@@ -625,11 +627,57 @@ def page_membros():
                 row.get("motivo_desligamento"),
                 row.get("mes_aniversario"),
                 row.get("id")
-            )
+            ))
             execute_query(update_sql, update_params)
         st.success("Alterações atualizadas!")
         st.rerun()
 
+    # Ações em lote (vários membros numa única transação)
+    with st.expander("Ações em lote"):
+        if membros_df.empty:
+            st.info("Cadastre membros para usar as ações em lote.")
+        else:
+            nomes = dict(zip(membros_df["id"], membros_df["nome"]))
+            selecionados = st.multiselect("Membros", options=list(nomes), format_func=lambda i: nomes[i])
+            acao = st.selectbox("Ação", list(ACOES_LOTE_MEMBROS))
+            params_lote = None
+            if acao == "Desligar":
+                col_l1, col_l2 = st.columns(2)
+                with col_l1:
+                    try:
+                        data_lote = st.date_input("Data do desligamento", value=datetime.date.today(), min_value=datetime.date(1900, 1, 1), format="DD/MM/YYYY", key="data_lote")
+                    except TypeError:
+                        data_lote = st.date_input("Data do desligamento", value=datetime.date.today(), min_value=datetime.date(1900, 1, 1), key="data_lote")
+                with col_l2:
+                    motivo_lote = st.selectbox("Motivo do Desligamento", ["A pedido", "Ausência", "Transferência", "Outra denominação", "Outros motivos"], key="motivo_lote")
+                params_lote = (data_lote, motivo_lote)
+            elif acao == "Alterar ministério":
+                ministerio_lote = st.text_input("Novo ministério", key="ministerio_lote")
+                params_lote = (ministerio_lote.strip() or None,)
+
+            if selecionados:
+                ensure_finance_schema()  # a prévia conta os lançamentos ligados
+                previa = read_records_lote(
+                    """
+                    SELECT (SELECT COUNT(*) FROM Membros m JOIN #ids i ON i.id = m.id) AS membros,
+                           (SELECT COUNT(*) FROM DizimoLancamentos l JOIN #ids i ON i.id = l.membro_id) AS lancamentos
+                    """,
+                    selecionados
+                )
+                if not previa.empty:
+                    aviso = f"{int(previa['membros'].iloc[0])} membro(s) serão afetados pela ação '{acao}'."
+                    if acao == "Excluir":
+                        aviso += f" {int(previa['lancamentos'].iloc[0])} lançamento(s) financeiro(s) serão excluídos junto."
+                    st.warning(aviso)
+                confirma_lote = st.checkbox("Confirmo a ação em lote", key="confirma_lote")
+                if st.button("Aplicar ação em lote", disabled=not confirma_lote):
+                    resultado = execute_lote(ACOES_LOTE_MEMBROS[acao], selecionados, params_lote)
+                    if isinstance(resultado, int):
+                        st.success(f"Ação '{acao}' aplicada a {resultado} membro(s).")
+                        st.rerun()
+                    else:
+                        st.error(f"Falha na ação em lote: {resultado}")
+
     # Exclusão de membro
     with st.expander("Excluir Membro"):
         if "id" in membros_df.columns:
@@ -653,49 +701,29 @@ def page_membros():
                 sucesso = execute_query(delete_sql, (id_param,))
                 if sucesso is True:
                     st.success(f"Membro de ID {id_param} excluído.")
-                    st.session_state["membros_data"] = read_records("SELECT * FROM Membros")
+                    st.session_state["membros_data"] = read_cached(QUERY_MEMBROS, arrow=True)
                     st.rerun()
                 else:
                     st.error(f"Falha ao excluir membro: {sucesso}")
 
     # Pré-visualizar fotos
     st.subheader("Fotos dos Membros")
-    for _, row in st.session_state["membros_data"].iterrows():
-        if row.get("foto") is not None:
-            st.image(row["foto"], caption=row['nome'], width=100)
+    exibir_fotos_membros("fotos_membros")
 
 # -----------------------------------------------------------------------------
 # PÁGINA 3: Relatórios
 # -----------------------------------------------------------------------------
-
 def page_relatorios():
     st.header("Relatórios")
 
-    membros_df = st.session_state["membros_data"]
-
     col1, col2, col3 = st.columns(3)
 
     # 1) Geração de PDF do Certificado de Batismo
     with col1:
         if st.button("Gerar PDF - Certificado de Batismo"):
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=16, style='B')
-            pdf.cell(200, 10, txt="CERTIFICADO DE BATISMO", ln=1, align='C')
-            pdf.set_font("Arial", size=12)
-
-            pdf.ln(10)
-            pdf.multi_cell(0, 10, txt=(
-                "Declaramos que o membro [NOME] recebeu o Santo Batismo nesta igreja,\n"
-                "conforme as doutrinas cristãs, no dia [DATA].\n\n"
-                "Assinatura:\n"
-                "_________________________________________"
-            ))
-
-            pdf_data = pdf.output(dest="S").encode("latin-1")
             st.download_button(
                 label="Baixar PDF Certificado",
-                data=pdf_data,
+                data=certificado_batismo_pdf(),
                 file_name="certificado_batismo.pdf",
                 mime="application/pdf"
             )
@@ -703,65 +731,40 @@ def page_relatorios():
     # 2) Geração de Word (DOCX) da Carta de Transferência
     with col2:
         if st.button("Gerar Word - Carta de Transferência"):
-            doc = Document()
-            doc.add_heading("CARTA DE TRANSFERÊNCIA", 0)
-
-            p = doc.add_paragraph()
-            p.add_run("Aos cuidados da Igreja de destino,\n\n").bold = True
-            p.add_run(
-                "Certificamos que o(a) membro [NOME] faz parte de nossa congregação, "
-                "estando em comunhão, e solicitou transferência para a Igreja [DESTINO]. "
-                "Concede-se, portanto, esta carta para os devidos fins.\n\n"
-            )
-            p.add_run("Atenciosamente,\n[Igreja de Origem]")
-
-            doc_buffer = BytesIO()
-            doc.save(doc_buffer)
-            doc_buffer.seek(0)
-
             st.download_button(
                 label="Baixar Word Transferência",
-                data=doc_buffer.getvalue(),
+                data=carta_transferencia_docx(),
                 file_name="carta_transferencia.docx",
                 mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
             )
 
-    # 3) Geração de PDF - Carta por Ausência
+    # 3) Geração de PDF - Cartas por Ausência (uma por membro ausente)
     with col3:
+        meses_ausencia = st.number_input("Meses sem contribuição", min_value=1, max_value=60, value=3, step=1)
         if st.button("Gerar PDF - Carta por Ausência"):
-            pdf = FPDF()
-            pdf.add_page()
-            pdf.set_font("Arial", size=16, style='B')
-            pdf.cell(200, 10, txt="CARTA POR AUSÊNCIA", ln=1, align='C')
-            pdf.set_font("Arial", size=12)
-
-            pdf.ln(10)
-            pdf.multi_cell(0, 10, txt=(
-                "Ao(À) Sr(a). [NOME DO MEMBRO],\n\n"
-                "Consta em nossos registros que o(a) senhor(a) se encontra ausente de nossas atividades "
-                "e cultos por período prolongado. Solicitamos o comparecimento ou contato para "
-                "regularização de seu estado como membro ativo.\n\n"
-                "Atenciosamente,\n[Igreja]"
-            ))
-
-            pdf_data = pdf.output(dest="S").encode("latin-1")
-            st.download_button(
-                label="Baixar PDF Carta Ausência",
-                data=pdf_data,
-                file_name="carta_ausencia.pdf",
-                mime="application/pdf"
-            )
+            ausentes = detectar_ausentes(meses_ausencia)
+            if ausentes.empty:
+                st.info("Nenhum membro ativo sem contribuição no período.")
+            else:
+                st.download_button(
+                    label=f"Baixar PDF Cartas Ausência ({len(ausentes)})",
+                    data=gerar_cartas_ausencia_pdf(ausentes, tenant_config().get("nome", "Igreja")),
+                    file_name="cartas_ausencia.pdf",
+                    mime="application/pdf"
+                )
+                with st.expander("Membros ausentes"):
+                    st.dataframe(
+                        ausentes[["matricula", "nome", "ultima_competencia"]],
+                        hide_index=True,
+                        column_config=br_column_config(["ultima_competencia"])
+                    )
 
     # 4) Geração de Excel com os membros cadastrados
     st.subheader("Gerar Excel dos Membros Cadastrados")
     if st.button("Gerar Excel"):
-        output = BytesIO()
-        membros_sem_foto = st.session_state["membros_data"].drop(columns=["foto"], errors="ignore")
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            membros_sem_foto.to_excel(writer, sheet_name="Membros", index=False)
         st.download_button(
             label="Baixar Excel com Membros",
-            data=output.getvalue(),
+            data=excel_bytes(carregar_membros_sem_foto(), "Membros"),
             file_name="relatorio_membros.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
@@ -769,53 +772,24 @@ def page_relatorios():
 
 # -----------------------------------------------------------------------------
 # Página 4 (exclusiva para adm-financeiro): Página Financeira
-# -----------------------------------------------------------------------------
-def ensure_finance_schema():
-    """
-    Garante a existência da tabela/índices financeiros no SQL Server.
-    """
-    ddl = """
-    IF NOT EXISTS (SELECT * FROM sys.objects WHERE object_id = OBJECT_ID(N'[dbo].[DizimoLancamentos]') AND type in (N'U'))
-    BEGIN
-        CREATE TABLE [dbo].[DizimoLancamentos](
-            [id]                INT IDENTITY(1,1) PRIMARY KEY,
-            [membro_id]         INT NOT NULL,
-            [competencia]       DATE NOT NULL,
-            [valor_dizimo]      DECIMAL(10,2) NOT NULL DEFAULT 0,
-            [valor_oferta]      DECIMAL(10,2) NOT NULL DEFAULT 0,
-            [data_pagamento]    DATE NOT NULL,
-            [forma_pagamento]   VARCHAR(30) NULL,
-            [observacoes]       NVARCHAR(255) NULL,
-            [criado_em]         DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
-            [atualizado_em]     DATETIME2 NULL
-        );
-        ALTER TABLE [dbo].[DizimoLancamentos]
-            ADD CONSTRAINT FK_Dizimos_Membro
-            FOREIGN KEY ([membro_id]) REFERENCES [dbo].[Membros]([id]) ON DELETE CASCADE;
-
-        ALTER TABLE [dbo].[DizimoLancamentos]
-            ADD [ano] AS (YEAR([competencia])) PERSISTED,
-                [mes] AS (MONTH([competencia])) PERSISTED;
-
-        CREATE UNIQUE INDEX UX_Dizimo_MembroCompetencia
-            ON [dbo].[DizimoLancamentos]([membro_id], [ano], [mes]);
-    END
-    """
-    _ = execute_query(ddl)  # Ignora retorno; se já existir, não faz nada
 
 def page_financeiro():
     ensure_finance_schema()  # garante tabela/índices
 
     st.header("Página Financeira • Dízimos e Ofertas")
 
+    # Anos fechados para liberar/bloquear gravações: lidos do primário, sem
+    # cache nem réplica (outro processo pode ter acabado de fechar um ano)
+    fechados_escrita = anos_fechados(primario=True)
+
     # ==== TABS ====
-    tab1, tab2, tab3 = st.tabs(["➕ Lançar contribuição", "📊 Painel anual (estilo planilha)", "🧾 Gerenciar lançamentos"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["➕ Lançar contribuição", "📊 Painel anual (estilo planilha)", "🧾 Gerenciar lançamentos", "🔒 Fechar período", "🧮 Conciliação"])
 
     # ========= TAB 1: Lançar contribuição =========
     with tab1:
         st.subheader("Registrar contribuição mensal")
 
-        membros = read_records("SELECT id, nome FROM Membros ORDER BY nome")
+        membros = read_cached(QUERY_DIRETORIO_MEMBROS, arrow=True)
         if membros.empty:
             st.info("Cadastre membros antes de lançar contribuições.")
         else:
@@ -847,7 +821,11 @@ def page_financeiro():
             with col5:
                 observacoes = st.text_input("Observações (opcional)")
 
-            if st.button("Salvar / Atualizar"):
+            periodo_fechado = int(ano) in fechados_escrita
+            if periodo_fechado:
+                st.warning(f"O período {int(ano)} está fechado e não aceita lançamentos.")
+
+            if st.button("Salvar / Atualizar", disabled=periodo_fechado):
                 # INSERT; se já existir para (membro, ano, mes), faz UPDATE
                 insert_sql = """
                     INSERT INTO DizimoLancamentos (membro_id, competencia, valor_dizimo, valor_oferta, data_pagamento, forma_pagamento, observacoes)
@@ -880,64 +858,21 @@ def page_financeiro():
         st.subheader("Visão anual por membro (meses em colunas)")
 
         ano_sel = st.number_input("Ano", min_value=1900, max_value=2100, value=datetime.date.today().year, step=1)
-        # Busca totais mensais por membro
-        query = """
-            SELECT l.membro_id, m.nome,
-                   l.ano, l.mes,
-                   SUM(l.valor_dizimo)   AS total_dizimo,
-                   SUM(l.valor_oferta)   AS total_oferta
-              FROM DizimoLancamentos l
-              JOIN Membros m ON m.id = l.membro_id
-             WHERE l.ano = ?
-             GROUP BY l.membro_id, m.nome, l.ano, l.mes
-        """
-        df = read_records(query, params=(int(ano_sel),))
+        # Busca totais mensais por membro (anos fechados vêm do snapshot)
+        df = carregar_painel(ano_sel)
+        if int(ano_sel) in anos_fechados():
+            st.caption("🔒 Período fechado: valores do snapshot de fechamento.")
 
         if df.empty:
             st.info("Sem lançamentos para este ano.")
         else:
-            # Pivot para ficar igual à planilha de dizimistas (membros x 12 meses)
-            pvt_diz = df.pivot_table(index=["membro_id","nome"], columns="mes", values="total_dizimo", aggfunc="sum", fill_value=0.0)
-            pvt_oft = df.pivot_table(index=["membro_id","nome"], columns="mes", values="total_oferta", aggfunc="sum", fill_value=0.0)
-
-            # Ordena colunas 1..12
-            pvt_diz = pvt_diz.reindex(columns=range(1,13), fill_value=0.0)
-            pvt_oft = pvt_oft.reindex(columns=range(1,13), fill_value=0.0)
-
-            # Renomeia colunas para nomes de meses (abreviados PT-BR)
-            meses = {i: datetime.date(2000,i,1).strftime("%b").capitalize() for i in range(1,13)}
-            pvt_diz.rename(columns=meses, inplace=True)
-            pvt_oft.rename(columns=meses, inplace=True)
-
-            # Totais por linha
-            pvt_diz["Total Dízimo"] = pvt_diz.sum(axis=1)
-            pvt_oft["Total Ofertas"] = pvt_oft.sum(axis=1)
-
-            # Junta em um único dataframe (colunas em blocos)
-            painel = pd.concat(
-                {
-                    "Dízimo (R$)": pvt_diz,
-                    "Ofertas (R$)": pvt_oft
-                },
-                axis=1
-            )
-            painel = painel.reset_index().rename(columns={"membro_id":"ID", "nome":"Membro"})
-
-            st.dataframe(painel, use_container_width=True)
-
-            # Exportar para Excel (achata MultiIndex)
-            painel_excel = painel.copy()
-            if isinstance(painel_excel.columns, pd.MultiIndex):
-                painel_excel.columns = [
-                    " - ".join([str(x) for x in col if x is not None and str(x) != ""])
-                    for col in painel_excel.columns.to_flat_index()
-                ]
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-                painel_excel.to_excel(writer, index=False, sheet_name=f"{ano_sel}")
+            painel = montar_painel(df)
+            cols_valores = [c for c in painel.columns if c[0] in BLOCOS_PAINEL]
+            st.dataframe(formatar_br(painel, money_cols=cols_valores), use_container_width=True)
+
             st.download_button(
                 label="Baixar Excel do Painel",
-                data=output.getvalue(),
+                data=painel_excel_bytes(painel, ano_sel),
                 file_name=f"painel_dizimistas_{ano_sel}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
@@ -945,9 +880,9 @@ def page_financeiro():
             # KPIs simples
             total_ano = df["total_dizimo"].sum() + df["total_oferta"].sum()
             c1, c2, c3 = st.columns(3)
-            c1.metric("Total Dízimos (ano)", f"R$ {df['total_dizimo'].sum():.2f}")
-            c2.metric("Total Ofertas (ano)", f"R$ {df['total_oferta'].sum():.2f}")
-            c3.metric("Total Geral (ano)",  f"R$ {total_ano:.2f}")
+            c1.metric("Total Dízimos (ano)", fmt_brl(df["total_dizimo"].sum()))
+            c2.metric("Total Ofertas (ano)", fmt_brl(df["total_oferta"].sum()))
+            c3.metric("Total Geral (ano)",  fmt_brl(total_ano))
 
     # ========= TAB 3: Gerenciar lançamentos =========
     with tab3:
@@ -976,18 +911,22 @@ def page_financeiro():
             params.append(f"%{membro_g.strip()}%")
         base_q += " ORDER BY m.nome, l.mes"
 
-        lista = read_records(base_q, params=tuple(params))
+        lista = read_records(base_q, params=tuple(params), arrow=True)
         if lista.empty:
             st.info("Sem lançamentos no filtro.")
         else:
-            # Exibir data_pagamento em PT-BR
-            lista_br = df_to_br_display(lista, ["data_pagamento"])
-            st.dataframe(lista_br, use_container_width=True)
+            # Exibir data_pagamento e valores em PT-BR
+            st.dataframe(
+                formatar_br(lista, money_cols=["valor_dizimo", "valor_oferta"], date_cols=["data_pagamento"]),
+                use_container_width=True
+            )
 
             # Excluir
             with st.expander("Excluir lançamento"):
+                if int(ano_g) in fechados_escrita:
+                    st.info(f"O período {int(ano_g)} está fechado; os lançamentos não podem ser excluídos.")
                 id_del = st.selectbox("ID para excluir", options=lista["id"])
-                if st.button("Confirmar exclusão"):
+                if st.button("Confirmar exclusão", disabled=int(ano_g) in fechados_escrita):
                     ok = execute_query("DELETE FROM DizimoLancamentos WHERE id = ?", (int(id_del),))
                     if ok is True:
                         st.success(f"Lançamento {id_del} excluído.")
@@ -995,6 +934,62 @@ def page_financeiro():
                     else:
                         st.error(f"Falha ao excluir: {ok}")
 
+    # ========= TAB 4: Fechar período =========
+    with tab4:
+        st.subheader("Fechar período (ano)")
+        st.caption(
+            "O ano fechado não aceita mais lançamentos, alterações ou exclusões; "
+            "painel e totais passam a ser lidos do snapshot de fechamento."
+        )
+        fechados = read_cached("SELECT ano, total_dizimo, total_oferta, fechado_em FROM PeriodosFechados ORDER BY ano DESC")
+        if not fechados.empty:
+            st.dataframe(
+                formatar_br(fechados, money_cols=["total_dizimo", "total_oferta"], date_cols=["fechado_em"]),
+                hide_index=True, use_container_width=True
+            )
+
+        ano_f = st.number_input("Ano a fechar", min_value=1900, max_value=2100,
+                                value=datetime.date.today().year - 1, step=1, key="ano_f")
+        confirma = st.checkbox(f"Confirmo o fechamento de {int(ano_f)} (não pode ser desfeito)")
+        if st.button("Fechar período", disabled=not confirma or int(ano_f) in fechados_escrita):
+            ok = fechar_periodo(ano_f)
+            if ok is True:
+                st.success(f"Período {int(ano_f)} fechado.")
+                st.rerun()
+            else:
+                st.error(f"Falha ao fechar o período: {ok}")
+
+    # ========= TAB 5: Conciliação =========
+    with tab5:
+        st.subheader("Conciliação do ano")
+        st.caption(
+            "Totais por mês e forma de pagamento, por forma, e pela data do pagamento "
+            "em relação ao mês de competência, com subtotais e total geral."
+        )
+        ano_c = st.number_input("Ano", min_value=1900, max_value=2100, value=datetime.date.today().year, step=1, key="ano_c")
+        linhas = carregar_conciliacao(ano_c)
+        if linhas.empty:
+            st.info("Sem lançamentos para este ano.")
+        else:
+            conciliacao = montar_conciliacao(linhas)
+            geral = conciliacao["Por forma"].iloc[-1]
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Total Dízimos (ano)", fmt_brl(geral["Dízimo (R$)"]))
+            c2.metric("Total Ofertas (ano)", fmt_brl(geral["Ofertas (R$)"]))
+            c3.metric("Total Geral (ano)", fmt_brl(geral["Total (R$)"]))
+
+            for nome, tabela in conciliacao.items():
+                st.markdown(f"**{nome}**")
+                st.dataframe(formatar_br(tabela, money_cols=colunas_valores_conciliacao(tabela)),
+                             hide_index=True, use_container_width=True)
+
+            st.download_button(
+                label="Baixar Excel da Conciliação",
+                data=conciliacao_excel_bytes(conciliacao, int(ano_c)),
+                file_name=f"conciliacao_{int(ano_c)}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
 # -----------------------------------------------------------------------------
 # Página 5 (exclusiva para adm-secretaria): Página para secretários
 # -----------------------------------------------------------------------------
@@ -1003,18 +998,159 @@ def page_secretaria():
     st.header("Página da Secretaria")
     st.write("Aqui você pode adicionar funcionalidades financeiras, por exemplo.")
 
+# -----------------------------------------------------------------------------
+# Página 6 (exclusiva para adm): Manutenção
+# -----------------------------------------------------------------------------
+
+def page_manutencao():
+    st.header("Manutenção")
+
+    st.subheader("Conexão com o banco")
+    linhas = []
+    for t in tenants():
+        linhas.append({"igreja": t, "banco": "primário", **circuito(t).estado()})
+        replica = estado_replica(t)
+        if replica is not None:
+            linhas.append({"igreja": t, "banco": "réplica", **replica})
+    st.dataframe(pd.DataFrame(linhas), hide_index=True, use_container_width=True)
+    if st.button("Reiniciar circuito desta igreja"):
+        circuito().sucesso()
+        circuito(replica=True).sucesso()
+        st.rerun()
+
+    st.subheader("Imagens")
+    st.caption(
+        "Recodifica fotos de membros e logotipos já gravados: remove metadados, "
+        f"reduz para até {FOTO_MAX_LADO}px (fotos) / {LOGO_MAX_LADO}px (logotipo) e grava em JPEG (PNG se a imagem tiver transparência)."
+    )
+    limite_kb = st.number_input("Reprocessar imagens acima de (KB)", min_value=10, value=200, step=50)
+    if st.button("Reprocessar imagens"):
+        try:
+            with st.spinner("Reprocessando imagens..."):
+                qtd, antes, depois = reprocessar_imagens(int(limite_kb) * 1024)
+        except Exception as e:
+            st.error(f"Falha ao reprocessar imagens: {e}")
+        else:
+            st.success(
+                f"{qtd} imagem(ns) recodificada(s): "
+                f"{antes / 1_048_576:.1f} MB → {depois / 1_048_576:.1f} MB."
+            )
+
+    st.subheader("Backup das fotos")
+    st.caption(
+        "Gera no servidor um ZIP com as fotos dos membros (<matrícula>_<nome>.jpg + manifesto.csv), "
+        "lidas do banco em lotes. Para acervos grandes prefira: python cli.py exportar-fotos"
+    )
+    if st.button("Exportar fotos (ZIP)"):
+        destino = pathlib.Path(dados.config("backup_dir", "backups")) / tenant_atual() / (
+            f"fotos_membros_{datetime.datetime.now():%Y%m%d_%H%M%S}.zip"
+        )
+        try:
+            with st.spinner("Exportando fotos..."):
+                qtd, total = exportar_fotos_zip(destino)
+        except Exception as e:
+            st.error(f"Falha ao exportar fotos: {e}")
+        else:
+            st.success(f"{qtd} foto(s), {total / 1_048_576:.1f} MB: {destino}")
+            if qtd:
+                with open(destino, "rb") as arquivo:
+                    st.download_button("Baixar ZIP", data=arquivo, file_name=destino.name, mime="application/zip")
+
+    zip_fotos = st.file_uploader("Restaurar fotos de um ZIP exportado", type=["zip"])
+    somente_sem_foto = st.checkbox("Só para membros sem foto (não sobrescreve)", value=True)
+    if st.button("Restaurar fotos", disabled=zip_fotos is None):
+        try:
+            with st.spinner("Restaurando fotos..."):
+                restauradas, ignoradas = restaurar_fotos_zip(zip_fotos, somente_sem_foto=somente_sem_foto)
+        except Exception as e:
+            st.error(f"Falha ao restaurar fotos: {e}")
+        else:
+            st.success(f"{restauradas} foto(s) restaurada(s); {ignoradas} ignorada(s).")
+
+    st.subheader("Membros duplicados")
+    st.caption(
+        "Procura a mesma pessoa cadastrada mais de uma vez (nome parecido, mesma data de "
+        "nascimento, telefone ou e-mail). A mescla move os lançamentos para o cadastro mantido "
+        "e exclui o outro."
+    )
+    if st.button("Procurar duplicados"):
+        with st.spinner("Comparando cadastros..."):
+            st.session_state["duplicados"] = detectar_duplicados()
+    pares = st.session_state.get("duplicados")
+    if pares is not None:
+        if pares.empty:
+            st.info("Nenhum duplicado provável encontrado.")
+        else:
+            st.dataframe(pares, hide_index=True, use_container_width=True)
+            idx = st.selectbox(
+                "Par", pares.index,
+                format_func=lambda i: f"{pares.at[i, 'nome_a']} (id {pares.at[i, 'id_a']}) × "
+                                      f"{pares.at[i, 'nome_b']} (id {pares.at[i, 'id_b']})",
+            )
+            par = pares.loc[idx]
+            manter = st.radio(
+                "Cadastro que fica", [int(par["id_a"]), int(par["id_b"])], horizontal=True,
+                format_func=lambda i: f"id {i} - {par['nome_a'] if i == par['id_a'] else par['nome_b']}",
+            )
+            remover = int(par["id_b"]) if manter == par["id_a"] else int(par["id_a"])
+            confirmar = st.checkbox(f"Confirmo excluir o cadastro id {remover} após a mescla")
+            if st.button("Mesclar", disabled=not confirmar):
+                ok = mesclar_membros(manter, remover)
+                if ok is True:
+                    st.session_state["duplicados"] = pares.drop(
+                        pares.index[pares[["id_a", "id_b"]].isin([remover]).any(axis=1)]
+                    ).reset_index(drop=True)
+                    st.success(f"Cadastro {remover} mesclado em {manter}.")
+                else:
+                    st.error(f"Falha ao mesclar: {ok}")
+
+    st.subheader("Inicialização")
+    st.caption(
+        "Tempos (s) medidos neste processo. Para medir o cold start do import: "
+        "python cli.py medir-inicio --limite 3"
+    )
+    if dados.TEMPOS_INICIO:
+        st.dataframe(
+            pd.DataFrame(list(dados.TEMPOS_INICIO.items()), columns=["etapa", "segundos"]),
+            hide_index=True, use_container_width=True,
+        )
+    else:
+        st.info("Nenhum tempo registrado ainda.")
+
+    st.subheader("Partições financeiras")
+    st.caption("Cria com antecedência as partições anuais de DizimoLancamentos.")
+    anos_a_frente = st.number_input("Anos à frente", min_value=1, max_value=5, value=1, step=1)
+    if st.button("Criar partições"):
+        ok = manter_particoes_financeiras(int(anos_a_frente))
+        if ok is True:
+            st.success(f"Partições garantidas até {datetime.date.today().year + int(anos_a_frente)}.")
+        else:
+            st.error(f"Falha ao criar partições: {ok}")
+
 # -----------------------------------------------------------------------------
 # LÓGICA PRINCIPAL
 # -----------------------------------------------------------------------------
 
 def main():
+    inicio = time.perf_counter()
+    # Configuração Geral do Streamlit
+    st.set_page_config(page_title="Demonstração Local", layout="wide")
+    configurar_dados()
+    dados.iniciar_aquecimento()
+    init_session_state()
+    exibir_app()
+    # Só a primeira execução do processo conta (a dos reruns seguintes é menor)
+    dados.TEMPOS_INICIO.setdefault("primeira execução do script", round(time.perf_counter() - inicio, 3))
+
+
+def exibir_app():
     if not st.session_state["logged_in"]:
         login_screen()
         return
     logout_button()
     role = st.session_state["user_role"]
     pages = {
-        "adm": {"Cadastro de Igreja": page_igreja, "Cadastro de Membros": page_membros, "Relatórios": page_relatorios},
+        "adm": {"Cadastro de Igreja": page_igreja, "Cadastro de Membros": page_membros, "Relatórios": page_relatorios, "Manutenção": page_manutencao},
         "adm-financeiro": {"Cadastro de Igreja": page_igreja, "Cadastro de Membros": page_membros, "Relatórios": page_relatorios, "Página Financeira": page_financeiro},
         "adm-secretaria": {"Cadastro de Igreja": page_igreja, "Cadastro de Membros": page_membros}
     }.get(role, {})
@@ -1022,8 +1158,10 @@ def main():
         st.error("Usuário desconhecido. Verifique as credenciais.")
         return
     with st.sidebar:
+        st.caption(tenant_config().get("nome", tenant_atual()))
         choice = st.selectbox("Selecione a Página", list(pages.keys()))
     pages[choice]()
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,246 @@
+"""
+Detecção de membros duplicados (a mesma pessoa cadastrada duas vezes, com o
+nome escrito de outro jeito ou outra matrícula) e mescla dos cadastros.
+
+Em vez de comparar todos os pares, cada membro recebe chaves de bloqueio
+(tokens normalizados do nome, data de nascimento, telefone, e-mail) e só são
+comparados os membros que compartilham alguma chave. Os candidatos recebem a
+similaridade dos nomes (rapidfuzz, se instalado; senão difflib) e contam as
+evidências exatas (nascimento, telefone, e-mail).
+"""
+import difflib
+import itertools
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import dados
+
+# Similaridade de texto opcional (pip install rapidfuzz): bem mais rápida que o difflib
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    fuzz = process = None
+
+PARTICULAS = {"de", "da", "do", "das", "dos", "e"}
+LIMIAR_NOME = 88                 # nomes parecidos o bastante por si só
+LIMIAR_NOME_COM_EVIDENCIA = 70   # basta isso se nascimento/telefone/e-mail coincidirem
+# Chave muito comum não separa nada: blocos maiores que isso são ignorados
+# (sem o rapidfuzz cada par custa bem mais, então o limite é menor)
+TAMANHO_MAXIMO_BLOCO = 2000 if fuzz is not None else 200
+
+QUERY_MEMBROS_DEDUP = "SELECT id, matricula, nome, data_nascimento, telefone, email FROM Membros"
+
+
+# -----------------------------------------------------------------------------
+# Normalização e chaves de bloqueio
+# -----------------------------------------------------------------------------
+
+def normalizar_nome(nome):
+    """Minúsculas, sem acentos, pontuação nem partículas (de, da, dos...)."""
+    if nome is None or pd.isna(nome):
+        return ""
+    texto = unicodedata.normalize("NFKD", str(nome)).encode("ascii", "ignore").decode().lower()
+    return " ".join(t for t in re.findall(r"[a-z]+", texto) if t not in PARTICULAS)
+
+
+def _telefone(v):
+    # últimos 8 dígitos: ignora DDI/DDD, o 9 extra e a formatação
+    if v is None or pd.isna(v):
+        return None
+    digitos = re.sub(r"\D", "", str(v))
+    return digitos[-8:] if len(digitos) >= 8 else None
+
+
+def _email(v):
+    if v is None or pd.isna(v):
+        return None
+    v = str(v).strip().lower()
+    return v if "@" in v else None
+
+
+def preparar_membros(membros):
+    """Acrescenta as colunas normalizadas usadas no bloqueio e na comparação."""
+    m = membros.reset_index(drop=True)
+    m = m.assign(
+        nome_norm=m["nome"].map(normalizar_nome),
+        nascimento=pd.to_datetime(m["data_nascimento"], errors="coerce").dt.strftime("%Y-%m-%d"),
+        tel=m["telefone"].map(_telefone),
+        mail=m["email"].map(_email),
+    )
+    for c in ("nascimento", "tel", "mail"):
+        m[c] = m[c].astype(object).where(m[c].notna(), None)
+    return m
+
+
+def chaves_bloqueio(m):
+    """
+    DataFrame (pos, chave, evidencia) com as chaves de bloqueio de cada membro
+    (pos = posição em m). Chaves de nome: primeiro + último token e último
+    token + inicial do primeiro (pega erro de digitação no primeiro nome).
+    Chaves de evidência: data de nascimento, telefone e e-mail.
+    """
+    tokens = m["nome_norm"].str.split()
+    primeiro = tokens.str[0]
+    ultimo = tokens.str[-1]
+    chaves = [
+        ("n:" + primeiro + " " + ultimo, False),
+        ("s:" + ultimo + " " + primeiro.str[:1], False),
+        ("d:" + m["nascimento"], True),
+        ("t:" + m["tel"], True),
+        ("e:" + m["mail"], True),
+    ]
+    todas = pd.concat(
+        [pd.DataFrame({"pos": m.index, "chave": c, "evidencia": ev}) for c, ev in chaves],
+        ignore_index=True,
+    )
+    return todas.dropna().drop_duplicates(["pos", "chave"])
+
+
+def blocos(chaves, tamanho_maximo=TAMANHO_MAXIMO_BLOCO):
+    """Gera (posições, evidencia) de cada chave com 2 a tamanho_maximo membros."""
+    chaves = chaves.sort_values("chave", kind="stable")
+    k = chaves["chave"].to_numpy()
+    cortes = np.flatnonzero(k[1:] != k[:-1]) + 1
+    for posicoes, evidencia in zip(np.split(chaves["pos"].to_numpy(), cortes),
+                                   np.split(chaves["evidencia"].to_numpy(), cortes)):
+        if 1 < len(posicoes) <= tamanho_maximo:
+            yield posicoes, bool(evidencia[0])
+
+
+# -----------------------------------------------------------------------------
+# Comparação
+# -----------------------------------------------------------------------------
+
+def similaridade_nomes(a, b):
+    """0-100, sem depender da ordem das palavras."""
+    if fuzz is not None:
+        return fuzz.token_sort_ratio(a, b)
+    a, b = " ".join(sorted(a.split())), " ".join(sorted(b.split()))
+    return 100 * difflib.SequenceMatcher(None, a, b).ratio()
+
+
+def _pares_parecidos(nomes, limiar):
+    """(i, j, similaridade) dos pares i < j do bloco com similaridade >= limiar."""
+    if fuzz is not None:
+        # matriz do bloco inteiro calculada em C; em paralelo só nos blocos
+        # grandes (nos pequenos, criar as threads custa mais que comparar)
+        matriz = process.cdist(nomes, nomes, scorer=fuzz.token_sort_ratio, score_cutoff=limiar,
+                               workers=-1 if len(nomes) >= 256 else 1)
+        i, j = np.nonzero(np.triu(matriz, 1))
+        return zip(i.tolist(), j.tolist(), matriz[i, j].tolist())
+    ordenados = [" ".join(sorted(n.split())) for n in nomes]
+    pares = []
+    for i, j in itertools.combinations(range(len(nomes)), 2):
+        sm = difflib.SequenceMatcher(None, ordenados[i], ordenados[j])
+        # limites superiores baratos antes do ratio() completo
+        if sm.real_quick_ratio() * 100 >= limiar and sm.quick_ratio() * 100 >= limiar:
+            sim = sm.ratio() * 100
+            if sim >= limiar:
+                pares.append((i, j, sim))
+    return pares
+
+
+def encontrar_duplicados(membros):
+    """
+    Recebe os membros (id, matricula, nome, data_nascimento, telefone, email)
+    e retorna os pares prováveis de duplicados, mais prováveis primeiro.
+
+    Pares de um bloco de nome precisam de similaridade >= LIMIAR_NOME; os de
+    um bloco de evidência (mesmo nascimento/telefone/e-mail) bastam
+    LIMIAR_NOME_COM_EVIDENCIA.
+    """
+    colunas = [
+        "id_a", "matricula_a", "nome_a", "id_b", "matricula_b", "nome_b",
+        "similaridade", "evidencias", "mesmo_nascimento", "mesmo_telefone", "mesmo_email",
+    ]
+    if membros.empty:
+        return pd.DataFrame(columns=colunas)
+    m = preparar_membros(membros)
+    nomes = m["nome_norm"].tolist()
+
+    similares = {}
+    for posicoes, evidencia in blocos(chaves_bloqueio(m)):
+        limiar = LIMIAR_NOME_COM_EVIDENCIA if evidencia else LIMIAR_NOME
+        for i, j, sim in _pares_parecidos([nomes[p] for p in posicoes], limiar):
+            a, b = sorted((int(posicoes[i]), int(posicoes[j])))
+            similares[(a, b)] = sim
+
+    campos = {c: m[c].tolist() for c in ("id", "matricula", "nome", "nascimento", "tel", "mail")}
+    linhas = []
+    for (a, b), sim in similares.items():
+        iguais = [campos[c][a] is not None and campos[c][a] == campos[c][b] for c in ("nascimento", "tel", "mail")]
+        linhas.append((campos["id"][a], campos["matricula"][a], campos["nome"][a],
+                       campos["id"][b], campos["matricula"][b], campos["nome"][b],
+                       round(sim, 1), sum(iguais), *iguais))
+
+    resultado = pd.DataFrame(linhas, columns=colunas)
+    return resultado.sort_values(["evidencias", "similaridade"], ascending=False, ignore_index=True)
+
+
+def detectar_duplicados(tenant=None):
+    """Pares prováveis de membros duplicados da igreja."""
+    membros = dados.read_records(QUERY_MEMBROS_DEDUP, arrow=True, tenant=tenant)
+    return encontrar_duplicados(membros)
+
+
+# -----------------------------------------------------------------------------
+# Mescla
+# -----------------------------------------------------------------------------
+
+def mesclar_membros(id_manter, id_remover, tenant=None):
+    """
+    Mescla id_remover em id_manter numa única transação: move os lançamentos
+    de DizimoLancamentos (somando valores quando os dois têm a mesma
+    competência), completa os campos vazios do cadastro mantido e exclui o
+    duplicado. Anos fechados não aceitam a mescla (o gatilho de período
+    fechado desfaz tudo). Retorna True ou a mensagem de erro.
+    """
+    dados.ensure_finance_schema(tenant)
+    sql = """
+        SET NOCOUNT ON;
+        SET XACT_ABORT ON;
+        DECLARE @manter INT = ?, @remover INT = ?;
+        BEGIN TRANSACTION;
+        IF @manter = @remover
+           OR NOT EXISTS (SELECT 1 FROM Membros WITH (UPDLOCK, HOLDLOCK) WHERE id = @manter)
+           OR NOT EXISTS (SELECT 1 FROM Membros WITH (UPDLOCK, HOLDLOCK) WHERE id = @remover)
+            THROW 50003, N'Membros inválidos para mesclar.', 1;
+
+        -- mesma competência nos dois cadastros: soma no mantido
+        UPDATE k
+           SET valor_dizimo = k.valor_dizimo + r.valor_dizimo,
+               valor_oferta = k.valor_oferta + r.valor_oferta,
+               observacoes = COALESCE(k.observacoes, r.observacoes),
+               atualizado_em = SYSUTCDATETIME()
+          FROM DizimoLancamentos k
+          JOIN DizimoLancamentos r ON r.membro_id = @remover AND r.ano = k.ano AND r.mes = k.mes
+         WHERE k.membro_id = @manter;
+
+        DELETE r
+          FROM DizimoLancamentos r
+         WHERE r.membro_id = @remover
+           AND EXISTS (SELECT 1 FROM DizimoLancamentos k
+                        WHERE k.membro_id = @manter AND k.ano = r.ano AND k.mes = r.mes);
+
+        UPDATE DizimoLancamentos
+           SET membro_id = @manter, atualizado_em = SYSUTCDATETIME()
+         WHERE membro_id = @remover;
+
+        UPDATE k
+           SET foto = COALESCE(k.foto, r.foto),
+               matricula = COALESCE(k.matricula, r.matricula),
+               endereco = COALESCE(NULLIF(k.endereco, ''), r.endereco),
+               telefone = COALESCE(NULLIF(k.telefone, ''), r.telefone),
+               email = COALESCE(NULLIF(k.email, ''), r.email),
+               data_nascimento = COALESCE(k.data_nascimento, r.data_nascimento)
+          FROM Membros k
+          JOIN Membros r ON r.id = @remover
+         WHERE k.id = @manter;
+
+        DELETE FROM Membros WHERE id = @remover;
+        COMMIT TRANSACTION;
+    """
+    return dados.execute_query(sql, (int(id_manter), int(id_remover)), tenant=tenant)
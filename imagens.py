@@ -0,0 +1,263 @@
+"""
+Pipeline de imagens (fotos de membros e logotipo da igreja).
+
+Toda imagem enviada é validada, tem os metadados (EXIF/GPS) removidos, é
+reduzida ao tamanho máximo e recodificada antes de ir para o banco.
+"""
+import collections
+import csv
+import hashlib
+import logging
+import pathlib
+import re
+import unicodedata
+import zipfile
+from io import BytesIO, StringIO, TextIOWrapper
+
+import dados
+
+logger = logging.getLogger(__name__)
+
+FOTO_MAX_LADO = 800
+LOGO_MAX_LADO = 512
+QUALIDADE_JPEG = 85
+IMAGEM_MAX_PIXELS = 50_000_000  # acima disso a imagem é recusada (bomba de descompressão)
+
+
+def preparar_imagem(conteudo, max_lado=FOTO_MAX_LADO, qualidade=QUALIDADE_JPEG):
+    """
+    Valida e recodifica uma imagem: corrige a orientação, descarta metadados,
+    reduz o maior lado para max_lado px e grava JPEG (ou PNG, se houver
+    transparência). Levanta ValueError se o conteúdo não for uma imagem válida.
+    """
+    # Pillow só é carregado no primeiro upload/reprocessamento
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    # O Pillow só levanta erro acima do dobro de MAX_IMAGE_PIXELS (entre 1x e
+    # 2x apenas avisa); o limite de verdade é conferido pelo cabeçalho, antes
+    # de decodificar os pixels.
+    Image.MAX_IMAGE_PIXELS = IMAGEM_MAX_PIXELS
+    try:
+        with Image.open(BytesIO(conteudo)) as img:
+            if img.width * img.height > IMAGEM_MAX_PIXELS:
+                raise ValueError(f"imagem grande demais (acima de {IMAGEM_MAX_PIXELS // 1_000_000} MP).")
+            img.verify()
+        img = Image.open(BytesIO(conteudo))
+        img.load()
+    except (UnidentifiedImageError, OSError, SyntaxError,
+            Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ValueError("arquivo de imagem inválido ou grande demais.") from e
+
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((max_lado, max_lado), Image.LANCZOS)
+
+    saida = BytesIO()
+    transparente = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    if transparente:
+        img.convert("RGBA").save(saida, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(saida, format="JPEG", quality=qualidade, optimize=True, progressive=True)
+    return saida.getvalue()
+
+
+def reprocessar_imagens(limite_bytes=200_000, tenant=None):
+    """
+    Passa pelo pipeline de imagens as fotos e logotipos já gravados maiores
+    que limite_bytes. Lê e grava um blob por vez (memória constante) e só
+    substitui quando o resultado fica menor.
+    Retorna (quantidade, bytes_antes, bytes_depois).
+    """
+    alvos = [
+        ("Membros", "id", "foto", FOTO_MAX_LADO),
+        ("Igreja", "cnpj", "logotipo", LOGO_MAX_LADO),
+    ]
+    conx = dados.get_connection(tenant)
+    if not conx:
+        return 0, 0, 0
+    qtd = antes = depois = 0
+    try:
+        cursor = conx.cursor()
+        for tabela, chave, coluna, max_lado in alvos:
+            chaves = [r[0] for r in cursor.execute(
+                f"SELECT {chave} FROM {tabela} WHERE DATALENGTH({coluna}) > ?", limite_bytes
+            ).fetchall()]
+            for k in chaves:
+                row = cursor.execute(f"SELECT {coluna} FROM {tabela} WHERE {chave} = ?", k).fetchone()
+                if row is None or row[0] is None:
+                    continue
+                original = bytes(row[0])
+                try:
+                    novo = preparar_imagem(original, max_lado)
+                except Exception as e:
+                    # blob que não é imagem ou que o Pillow não consegue
+                    # recodificar: deixa como está e segue com os demais
+                    logger.warning("%s %s=%s não reprocessado: %s", tabela, chave, k, e)
+                    continue
+                if len(novo) < len(original):
+                    cursor.execute(f"UPDATE {tabela} SET {coluna} = ? WHERE {chave} = ?", novo, k)
+                    conx.commit()
+                    qtd += 1
+                    antes += len(original)
+                    depois += len(novo)
+    finally:
+        conx.close()
+        dados.invalidar_cache(tenant)
+    return qtd, antes, depois
+
+
+# -----------------------------------------------------------------------------
+# Backup das fotos dos membros (ZIP gravado em fluxo)
+# -----------------------------------------------------------------------------
+# As fotos saem do banco em lotes (fetchmany sobre um cursor só de avanço) e
+# vão direto para o ZIP em disco, uma a uma: a memória usada é a de um lote,
+# não a do acervo. A restauração lê o ZIP entrada por entrada e confirma a
+# cada lote. Arquivos: <matricula>_<nome>.<ext> (id<id> sem matrícula), mais
+# um manifesto.csv com id, matrícula, nome, arquivo, bytes e sha256.
+
+LOTE_FOTOS = 50
+MANIFESTO_FOTOS = "manifesto.csv"
+FOTO_BACKUP_MAX_BYTES = 20 * 1_048_576  # entradas maiores são ignoradas na restauração
+
+
+def _extensao_imagem(conteudo):
+    if conteudo[:3] == b"\xff\xd8\xff":
+        return "jpg"
+    if conteudo[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if conteudo[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if conteudo[:4] == b"RIFF" and conteudo[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _nome_arquivo_foto(membro_id, matricula, nome, ext, usados):
+    chave = str(int(matricula)) if matricula is not None else f"id{int(membro_id)}"
+    nome = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode()
+    nome = re.sub(r"[^A-Za-z0-9]+", "_", nome).strip("_")[:60]
+    arquivo = f"{chave}_{nome}.{ext}"
+    if arquivo in usados:  # matrícula repetida: desempata pelo id
+        arquivo = f"{chave}_{nome}_id{int(membro_id)}.{ext}"
+    usados.add(arquivo)
+    return arquivo
+
+
+def exportar_fotos_zip(destino, lote=LOTE_FOTOS, tenant=None):
+    """
+    Grava as fotos dos membros num ZIP em destino (sem compressão: JPEG/PNG já
+    são comprimidos). O arquivo só aparece no destino quando completo.
+    Retorna (quantidade, bytes).
+    """
+    destino = pathlib.Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    parcial = destino.with_name(destino.name + ".parcial")
+    conx = dados.get_connection(tenant)
+    if not conx:
+        return 0, 0
+    qtd = total = 0
+    usados = set()
+    manifesto = StringIO()
+    escritor = csv.writer(manifesto, delimiter=";")
+    escritor.writerow(["id", "matricula", "nome", "arquivo", "bytes", "sha256"])
+    try:
+        cursor = conx.cursor()
+        cursor.execute("SELECT id, matricula, nome, foto FROM Membros WHERE foto IS NOT NULL ORDER BY id")
+        with zipfile.ZipFile(parcial, "w", compression=zipfile.ZIP_STORED) as zf:
+            while True:
+                linhas = cursor.fetchmany(lote)
+                if not linhas:
+                    break
+                for membro_id, matricula, nome, foto in linhas:
+                    foto = bytes(foto)
+                    arquivo = _nome_arquivo_foto(membro_id, matricula, nome, _extensao_imagem(foto) or "bin", usados)
+                    zf.writestr(arquivo, foto)
+                    escritor.writerow([membro_id, matricula, nome, arquivo, len(foto), hashlib.sha256(foto).hexdigest()])
+                    qtd += 1
+                    total += len(foto)
+            zf.writestr(MANIFESTO_FOTOS, manifesto.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+        parcial.replace(destino)
+    finally:
+        conx.close()
+        parcial.unlink(missing_ok=True)
+    return qtd, total
+
+
+def _chave_foto(arquivo, meta, ambiguas):
+    """
+    ('matricula', n) ou ('id', n) a partir do manifesto ou do nome do arquivo.
+    Matrícula repetida (no ZIP ou no banco, em 'ambiguas') não identifica o
+    membro: usa o id do manifesto ou, sem ele, não casa (None).
+    """
+    if meta:
+        if meta.get("matricula") and int(meta["matricula"]) not in ambiguas:
+            return "matricula", int(meta["matricula"])
+        return "id", int(meta["id"])
+    prefixo = pathlib.PurePosixPath(arquivo).stem.split("_", 1)[0]
+    if prefixo.startswith("id") and prefixo[2:].isdigit():
+        return "id", int(prefixo[2:])
+    if prefixo.isdigit() and int(prefixo) not in ambiguas:
+        return "matricula", int(prefixo)
+    return None
+
+
+def restaurar_fotos_zip(origem, somente_sem_foto=False, lote=LOTE_FOTOS, tenant=None):
+    """
+    Regrava em Membros.foto as fotos de um ZIP de exportar_fotos_zip (caminho
+    ou arquivo aberto), casando por matrícula (ou pelo id, quando a matrícula
+    se repete). Entradas que não são imagem, não conferem com o sha256 do
+    manifesto ou não casam com exatamente um membro são ignoradas.
+    Retorna (restauradas, ignoradas).
+    """
+    restauradas = ignoradas = 0
+    with zipfile.ZipFile(origem) as zf:
+        manifesto = {}
+        if MANIFESTO_FOTOS in zf.namelist():
+            with zf.open(MANIFESTO_FOTOS) as f:
+                for meta in csv.DictReader(TextIOWrapper(f, encoding="utf-8"), delimiter=";"):
+                    manifesto[meta["arquivo"]] = meta
+
+        conx = dados.get_connection(tenant)
+        if not conx:
+            return 0, 0
+        try:
+            cursor = conx.cursor()
+            repetidas_zip = collections.Counter(int(m["matricula"]) for m in manifesto.values() if m.get("matricula"))
+            ambiguas = {m for m, n in repetidas_zip.items() if n > 1}
+            ambiguas.update(r[0] for r in cursor.execute(
+                "SELECT matricula FROM Membros WHERE matricula IS NOT NULL GROUP BY matricula HAVING COUNT(*) > 1"
+            ).fetchall())
+            pendentes = 0
+            for info in zf.infolist():
+                if info.is_dir() or info.filename == MANIFESTO_FOTOS:
+                    continue
+                meta = manifesto.get(info.filename)
+                chave = _chave_foto(info.filename, meta, ambiguas)
+                if chave is None or info.file_size > FOTO_BACKUP_MAX_BYTES:
+                    ignoradas += 1
+                    continue
+                with zf.open(info) as f:
+                    foto = f.read()
+                if _extensao_imagem(foto) is None or (meta and hashlib.sha256(foto).hexdigest() != meta["sha256"]):
+                    ignoradas += 1
+                    continue
+                coluna, valor = chave
+                sql = f"UPDATE Membros SET foto = ? WHERE {coluna} = ?"
+                if somente_sem_foto:
+                    sql += " AND foto IS NULL"
+                cursor.execute(sql, foto, valor)
+                if cursor.rowcount == 1:
+                    restauradas += 1
+                else:
+                    ignoradas += 1
+                pendentes += 1
+                if pendentes >= lote:
+                    conx.commit()
+                    pendentes = 0
+            conx.commit()
+        except Exception:
+            conx.rollback()
+            raise
+        finally:
+            conx.close()
+            dados.invalidar_cache(tenant)
+    return restauradas, ignoradas
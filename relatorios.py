@@ -0,0 +1,302 @@
+"""
+Formatação PT-BR e geração de relatórios/documentos (Excel, PDF, Word).
+
+Funções puras sobre DataFrames: não acessam o banco nem o Streamlit, e por
+isso servem tanto à aplicação quanto à linha de comando.
+"""
+import datetime
+import functools
+from io import BytesIO
+
+import pandas as pd
+
+# fpdf e python-docx (que traz o lxml) são importados dentro das funções de
+# documento: só carregam no primeiro relatório pedido, não no login.
+
+# -----------------------------------------------------------------------------
+# Helpers de formatação PT-BR (somente EXIBIÇÃO): datas e moeda
+# -----------------------------------------------------------------------------
+# As funções de valor são memorizadas: uma listagem tem poucas datas e valores
+# distintos repetidos em muitas linhas, então cada valor é formatado uma única
+# vez. Nas grades a formatação é só de exibição (column_config ou as colunas
+# de texto de formatar_br), sem alterar os DataFrames originais.
+
+@functools.lru_cache(maxsize=8192)
+def _fmt_date_br(d):
+    if isinstance(d, (datetime.date, datetime.datetime)):
+        return d.strftime("%d/%m/%Y")
+    # tenta normalizar com pandas
+    ts = pd.to_datetime(d, errors="coerce")
+    if pd.isna(ts):
+        return ""
+    return ts.strftime("%d/%m/%Y")
+
+
+def fmt_date_br(d):
+    """Converte uma data para 'DD/MM/YYYY' somente para exibição."""
+    if d is None or d == "" or pd.isna(d):
+        return ""
+    return _fmt_date_br(d)
+
+
+@functools.lru_cache(maxsize=8192)
+def _fmt_brl(v):
+    txt = f"{v:,.2f}".replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"R$ {txt}"
+
+
+def fmt_brl(v):
+    """Formata um valor como moeda brasileira: 'R$ 1.234,56'."""
+    if v is None or pd.isna(v):
+        return ""
+    return _fmt_brl(round(float(v), 2))
+
+
+def _formatar_coluna(serie, fmt):
+    # formata cada valor distinto uma vez e espalha pela coluna inteira
+    unicos = serie.dropna().unique()
+    return serie.map({v: fmt(v) for v in unicos}).astype(object).where(serie.notna(), "")
+
+
+def formatar_br(df, money_cols=(), date_cols=()):
+    """
+    Cópia rasa do DataFrame com as colunas de valores como 'R$ 1.234,56' e as
+    de datas como 'DD/MM/YYYY' (texto, somente para exibição); as demais
+    colunas não são copiadas nem convertidas.
+    """
+    exibicao = df.copy(deep=False)
+    for c in money_cols:
+        exibicao[c] = _formatar_coluna(df[c], fmt_brl)
+    for c in date_cols:
+        exibicao[c] = _formatar_coluna(df[c], fmt_date_br)
+    return exibicao
+
+
+def excel_bytes(df, sheet_name, money_cols=()):
+    """
+    Gera um .xlsx com datas em DD/MM/AAAA e as colunas de valores no formato
+    de moeda brasileira, mantendo os números como números na planilha.
+    """
+    return excel_abas_bytes({sheet_name: df}, money_cols=money_cols)
+
+
+def excel_abas_bytes(abas, money_cols=()):
+    """Como excel_bytes, com uma aba por item de {nome da aba: DataFrame}."""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter", date_format="dd/mm/yyyy",
+                        datetime_format="dd/mm/yyyy") as writer:
+        moeda = writer.book.add_format({"num_format": '"R$" #,##0.00'})
+        for sheet_name, df in abas.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            planilha = writer.sheets[sheet_name]
+            for i, c in enumerate(df.columns):
+                if c in money_cols:
+                    planilha.set_column(i, i, 14, moeda)
+    return output.getvalue()
+
+
+# -----------------------------------------------------------------------------
+# Painel anual de dizimistas (membros x 12 meses)
+# -----------------------------------------------------------------------------
+
+BLOCOS_PAINEL = ("Dízimo (R$)", "Ofertas (R$)")
+
+
+def montar_painel(df):
+    """
+    Recebe os totais por membro/mês (membro_id, nome, mes, total_dizimo,
+    total_oferta) e monta o painel no formato da planilha de dizimistas.
+    """
+    # Pivot para ficar igual à planilha de dizimistas (membros x 12 meses)
+    pvt_diz = df.pivot_table(index=["membro_id","nome"], columns="mes", values="total_dizimo", aggfunc="sum", fill_value=0.0)
+    pvt_oft = df.pivot_table(index=["membro_id","nome"], columns="mes", values="total_oferta", aggfunc="sum", fill_value=0.0)
+
+    # Ordena colunas 1..12
+    pvt_diz = pvt_diz.reindex(columns=range(1,13), fill_value=0.0)
+    pvt_oft = pvt_oft.reindex(columns=range(1,13), fill_value=0.0)
+
+    # Renomeia colunas para nomes de meses (abreviados PT-BR)
+    meses = {i: datetime.date(2000,i,1).strftime("%b").capitalize() for i in range(1,13)}
+    pvt_diz.rename(columns=meses, inplace=True)
+    pvt_oft.rename(columns=meses, inplace=True)
+
+    # Totais por linha
+    pvt_diz["Total Dízimo"] = pvt_diz.sum(axis=1)
+    pvt_oft["Total Ofertas"] = pvt_oft.sum(axis=1)
+
+    # Junta em um único dataframe (colunas em blocos)
+    painel = pd.concat(
+        {
+            BLOCOS_PAINEL[0]: pvt_diz,
+            BLOCOS_PAINEL[1]: pvt_oft
+        },
+        axis=1
+    )
+    return painel.reset_index().rename(columns={"membro_id":"ID", "nome":"Membro"})
+
+
+def painel_excel_bytes(painel, ano):
+    """Excel do painel (achata o MultiIndex das colunas)."""
+    painel_excel = painel.copy()
+    if isinstance(painel_excel.columns, pd.MultiIndex):
+        painel_excel.columns = [
+            " - ".join([str(x) for x in col if x is not None and str(x) != ""])
+            for col in painel_excel.columns.to_flat_index()
+        ]
+    cols_valores = [c for c in painel_excel.columns if c not in ("ID", "Membro")]
+    return excel_bytes(painel_excel, f"{ano}", money_cols=cols_valores)
+
+
+# -----------------------------------------------------------------------------
+# Conciliação financeira (linhas do GROUPING SETS de dados.QUERY_CONCILIACAO)
+# -----------------------------------------------------------------------------
+
+COLUNAS_VALORES_CONCILIACAO = ("total_dizimo", "total_oferta", "total")
+SITUACOES_PAGAMENTO = ("Antecipado", "No mês", "Em atraso")  # como no CASE da consulta
+
+
+def _nome_mes(m):
+    return datetime.date(2000, int(m), 1).strftime("%b").capitalize()
+
+
+def montar_conciliacao(df):
+    """
+    Separa as linhas da conciliação por nível (colunas g_*) em tabelas prontas
+    para exibir/exportar: {"Mês x forma", "Por forma", "Por situação",
+    "Situação x mês"}. Subtotais e total geral vêm do banco, sem somar aqui.
+    """
+    df = df.copy()
+    for c in ("lancamentos", "membros") + COLUNAS_VALORES_CONCILIACAO:
+        df[c] = pd.to_numeric(df[c]).astype(float if c in COLUNAS_VALORES_CONCILIACAO else int)
+    for c in ("mes", "g_mes", "g_forma", "g_situacao"):
+        df[c] = pd.to_numeric(df[c]).fillna(0).astype(int)
+    nivel = df["g_mes"].astype(str) + df["g_forma"].astype(str) + df["g_situacao"].astype(str)
+    geral = df[nivel == "111"].assign(mes=0)
+    medidas = ["lancamentos", "membros", *COLUNAS_VALORES_CONCILIACAO]
+
+    # Mês x forma, com subtotal do mês logo após as formas e o total geral no fim
+    mes_forma = pd.concat([df[nivel == "001"], df[nivel == "011"]])
+    mes_forma = mes_forma.sort_values(["mes", "g_forma", "forma_pagamento"])
+    mes_forma = pd.concat([mes_forma, geral])
+    mes_forma["Mês"] = [
+        "Total geral" if g else _nome_mes(m) for m, g in zip(mes_forma["mes"], mes_forma["g_mes"])
+    ]
+    mes_forma["forma_pagamento"] = mes_forma["forma_pagamento"].where(mes_forma["g_forma"] == 0, "Subtotal")
+    mes_forma.loc[mes_forma["g_mes"] == 1, "forma_pagamento"] = ""
+    mes_forma = mes_forma[["Mês", "forma_pagamento", *medidas]]
+
+    por_forma = pd.concat([df[nivel == "101"].sort_values("total", ascending=False), geral])
+    por_forma["forma_pagamento"] = por_forma["forma_pagamento"].where(por_forma["g_forma"] == 0, "Total geral")
+    por_forma = por_forma[["forma_pagamento", *medidas]]
+
+    ordem = {s: i for i, s in enumerate(SITUACOES_PAGAMENTO)}
+    por_situacao = df[nivel == "110"].sort_values("situacao", key=lambda c: c.map(ordem))
+    por_situacao = pd.concat([por_situacao, geral])
+    por_situacao["situacao"] = por_situacao["situacao"].where(por_situacao["g_situacao"] == 0, "Total geral")
+    por_situacao = por_situacao[["situacao", *medidas]]
+
+    # Situação x mês (total em R$), com o total do mês vindo do subtotal (mes)
+    sit_mes = df[nivel == "010"].pivot_table(index="mes", columns="situacao", values="total", aggfunc="sum", fill_value=0.0)
+    sit_mes = sit_mes.reindex(columns=[s for s in ordem if s in sit_mes.columns])
+    sit_mes["Total"] = df[nivel == "011"].set_index("mes")["total"]
+    sit_mes.index = [_nome_mes(m) for m in sit_mes.index]
+    sit_mes = sit_mes.rename_axis(index="Mês", columns=None).reset_index()
+
+    renomear = {
+        "forma_pagamento": "Forma de pagamento", "situacao": "Situação",
+        "lancamentos": "Lançamentos", "membros": "Membros",
+        "total_dizimo": "Dízimo (R$)", "total_oferta": "Ofertas (R$)", "total": "Total (R$)",
+    }
+    return {
+        "Mês x forma": mes_forma.rename(columns=renomear).reset_index(drop=True),
+        "Por forma": por_forma.rename(columns=renomear).reset_index(drop=True),
+        "Por situação": por_situacao.rename(columns=renomear).reset_index(drop=True),
+        "Situação x mês": sit_mes,
+    }
+
+
+def colunas_valores_conciliacao(tabela):
+    """Colunas em R$ de uma tabela de montar_conciliacao (para formatação)."""
+    return [c for c in tabela.columns if c.endswith("(R$)") or c in (*SITUACOES_PAGAMENTO, "Total")]
+
+
+def conciliacao_excel_bytes(conciliacao, ano):
+    """Excel da conciliação: uma aba por tabela, valores em R$."""
+    abas = {f"{nome} {ano}": tabela for nome, tabela in conciliacao.items()}
+    money_cols = {c for tabela in abas.values() for c in colunas_valores_conciliacao(tabela)}
+    return excel_abas_bytes(abas, money_cols=money_cols)
+
+
+# -----------------------------------------------------------------------------
+# Documentos (PDF / Word)
+# -----------------------------------------------------------------------------
+
+def certificado_batismo_pdf():
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=16, style='B')
+    pdf.cell(200, 10, txt="CERTIFICADO DE BATISMO", ln=1, align='C')
+    pdf.set_font("Arial", size=12)
+
+    pdf.ln(10)
+    pdf.multi_cell(0, 10, txt=(
+        "Declaramos que o membro [NOME] recebeu o Santo Batismo nesta igreja,\n"
+        "conforme as doutrinas cristãs, no dia [DATA].\n\n"
+        "Assinatura:\n"
+        "_________________________________________"
+    ))
+
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def carta_transferencia_docx():
+    from docx import Document
+
+    doc = Document()
+    doc.add_heading("CARTA DE TRANSFERÊNCIA", 0)
+
+    p = doc.add_paragraph()
+    p.add_run("Aos cuidados da Igreja de destino,\n\n").bold = True
+    p.add_run(
+        "Certificamos que o(a) membro [NOME] faz parte de nossa congregação, "
+        "estando em comunhão, e solicitou transferência para a Igreja [DESTINO]. "
+        "Concede-se, portanto, esta carta para os devidos fins.\n\n"
+    )
+    p.add_run("Atenciosamente,\n[Igreja de Origem]")
+
+    doc_buffer = BytesIO()
+    doc.save(doc_buffer)
+    return doc_buffer.getvalue()
+
+
+def _latin1(txt):
+    # FPDF 1.7 só escreve latin-1; caracteres fora dele viram '?'
+    return str(txt).encode("latin-1", "replace").decode("latin-1")
+
+
+def gerar_cartas_ausencia_pdf(ausentes, nome_igreja):
+    """Gera um único PDF com uma Carta por Ausência personalizada por membro."""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    for _, membro in ausentes.iterrows():
+        pdf.add_page()
+        pdf.set_font("Arial", size=16, style='B')
+        pdf.cell(200, 10, txt="CARTA POR AUSÊNCIA", ln=1, align='C')
+        pdf.set_font("Arial", size=12)
+
+        pdf.ln(10)
+        endereco = membro.get("endereco")
+        if endereco is not None and not pd.isna(endereco):
+            pdf.multi_cell(0, 8, txt=_latin1(endereco))
+            pdf.ln(4)
+        pdf.multi_cell(0, 10, txt=_latin1(
+            f"Ao(À) Sr(a). {membro['nome']},\n\n"
+            "Consta em nossos registros que o(a) senhor(a) se encontra ausente de nossas atividades "
+            "e cultos por período prolongado. Solicitamos o comparecimento ou contato para "
+            "regularização de seu estado como membro ativo.\n\n"
+            f"Atenciosamente,\n{nome_igreja}"
+        ))
+    return pdf.output(dest="S").encode("latin-1")